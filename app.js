@@ -1,11 +1,29 @@
 require('dotenv').config();
 
+const crypto = require('crypto');
 const express = require('express');
 const tokenRoutes = require('./routes/tokenRoutes');
+const metrics = require('./utils/metrics');
 
 const app = express();
 app.use(express.json());
 
 app.use('/api', tokenRoutes); // e.g. /api/generate-token
 
+// Constant-time check of the x-api-key header against the secret the token routes use
+const hasApiKey = (req) => {
+  const expected = Buffer.from(process.env.ICICLE_API_KEY || '');
+  const given = Buffer.from(req.headers['x-api-key'] || '');
+  return expected.length > 0 && given.length === expected.length && crypto.timingSafeEqual(given, expected);
+};
+
+// Prometheus scrape endpoint; counts and timings only, no tokens or customer ids.
+// Store size and validate/expire counts are operator data, so it needs the API key
+app.get('/metrics', (req, res) => {
+  if (!hasApiKey(req)) {
+    return res.status(401).json({ error: 'Invalid API key' });
+  }
+  res.type('text/plain; version=0.0.4').send(metrics.render());
+});
+
 app.listen(3000, () => console.log('Backend listening on :3000'));
@@ -0,0 +1,241 @@
+"""Benchmark the chart pipeline without Streamlit.
+
+Runs loading, customer discovery, hop filtering, tree building, validation and
+figure building against every shipped CSV plus synthetic scale-ups of one file,
+and writes the results to bench_results/ so runs from different versions can be
+compared.
+
+    python bench_charts.py                          # shipped files + 10x/100x/1000x
+    python bench_charts.py --scales 10 --repeat 3
+    python bench_charts.py --scales --generated 100000 1000000
+    python bench_charts.py --compare bench_results/<older run>.json
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+from chart_engine import (
+    ALL_CUSTOMERS, MAX_HOPS, filter_customer, deepest_hop, hop_options, filter_hops,
+    build_upstream_chart, build_downstream_chart, validate_tree_data, analyze_positions, fold_tail
+)
+from chart_data import load_chain_csv, lean_frame, customer_directory, customer_names
+from chart_figures import icicle_figure
+from synthetic_chains import generate_frame, write_csv
+
+
+DATASET_GLOBS = [
+    "duration/*.csv",
+    "upstream_duration/*.csv",
+    "shifted_upstream_duration/*.csv",
+    "shifted_downstream_duration/*.csv",
+    "archive/*.csv",
+]
+SCALE_BASE = "shifted_upstream_duration/shifted_upstream_duration_1month.csv"
+RESULTS_DIR = "bench_results"
+
+
+# ---------------------- Datasets ----------------------
+
+def direction_of(path):
+    return "upstream" if "upstream" in path else "downstream"
+
+
+def scale_frame(df, factor):
+    """Replicate ``df`` ``factor`` times, suffixing hop partners per copy so the trees grow too"""
+    copies = [df]
+    for k in range(1, factor):
+        copy = df.copy()
+        for i in range(1, MAX_HOPS + 1):
+            col = f'customer_{i}'
+            names = copy[col].astype(str)
+            copy[col] = names.where(names == '', names + f" #{k}")
+        copies.append(copy)
+    # Re-encode like load_chain_csv so memory figures match what the pages hold
+    return lean_frame(pd.concat(copies, ignore_index=True).drop(columns=['original_customer', 'customer_cleaned']))
+
+
+def top_customer(df):
+    """Return the cleaned name of the customer with the most events"""
+    totals = df.groupby('customer_cleaned', observed=True)['event_count'].sum()
+    return totals.idxmax()
+
+
+# ---------------------- Measurement ----------------------
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    rank = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def measure(fn, repeat):
+    """Time ``fn`` ``repeat`` times, then run it once more under tracemalloc for peak memory"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "runs": repeat,
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+        "max_ms": round(max(samples), 3),
+        "peak_mb": round(peak / 1024 / 1024, 3),
+    }, result
+
+
+def node_count(result):
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return None
+
+
+def cases_for(df, direction, path=None):
+    """Return ``[(case name, callable)]`` for one dataset"""
+    customer = top_customer(df)
+    build = build_upstream_chart if direction == "upstream" else build_downstream_chart
+
+    def figure():
+        labels, parents, values, ids, totals, _ = build(df, ALL_CUSTOMERS)
+        return icicle_figure(*fold_tail(labels, parents, values, ids, totals)[:5], title="", color="#D96F32")
+
+    cases = []
+    if path:
+        cases.append(("load", lambda: load_chain_csv(path)))
+    cases += [
+        ("discover_customers", lambda: (customer_directory(df), customer_names(df))),
+        ("build_all_customers", lambda: build(df, ALL_CUSTOMERS)),
+        ("build_top_customer", lambda: build(df, customer)),
+        ("hop_options", lambda: hop_options(df, customer)),
+        ("filter_hops", lambda: filter_hops(df, {}, customer)),
+        ("deepest_hop", lambda: deepest_hop(filter_customer(df, customer), customer)),
+        ("validate_tree_data", lambda: validate_tree_data(df, direction, customer)),
+        ("analyze_positions", lambda: analyze_positions(filter_customer(df, customer), direction, customer)),
+        ("figure_all_customers", figure),
+    ]
+    return cases
+
+
+def run_dataset(name, df, direction, repeat, path=None):
+    rows = []
+    for case, fn in cases_for(df, direction, path):
+        stats, result = measure(fn, repeat)
+        row = {"dataset": name, "rows": len(df), "case": case, **stats, "nodes": node_count(result)}
+        rows.append(row)
+        print(f"{name:<72} {case:<22} p50 {row['p50_ms']:>10.1f}ms  p95 {row['p95_ms']:>10.1f}ms  "
+              f"peak {row['peak_mb']:>8.1f}MB  nodes {row['nodes'] if row['nodes'] is not None else '-'}")
+    return rows
+
+
+# ---------------------- Results ----------------------
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def save_results(rows, version):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(RESULTS_DIR, f"{stamp}_{version}.json")
+    with open(path, "w") as file:
+        json.dump({
+            "version": version,
+            "created_at": stamp,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "results": rows,
+        }, file, indent=2)
+    return path
+
+
+def latest_results(exclude):
+    runs = sorted(p for p in glob.glob(os.path.join(RESULTS_DIR, "*.json")) if p != exclude)
+    return runs[-1] if runs else None
+
+
+def compare(rows, baseline_path):
+    """Print p50 and peak memory changes against an earlier run"""
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    previous = {(r["dataset"], r["case"]): r for r in baseline["results"]}
+
+    print(f"\nCompared with {baseline['version']} ({baseline_path})")
+    for row in rows:
+        before = previous.get((row["dataset"], row["case"]))
+        if not before or not before["p50_ms"]:
+            continue
+        change = (row["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+        flag = "  ⚠️" if change > 10 else ""
+        print(f"{row['dataset']:<72} {row['case']:<22} p50 {change:+7.1f}%  "
+              f"peak {before['peak_mb']:.1f}MB → {row['peak_mb']:.1f}MB{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark icicle chart building without Streamlit")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case on the shipped files")
+    parser.add_argument("--scale-repeat", type=int, default=1, help="timed runs per case on synthetic data")
+    parser.add_argument("--scales", type=int, nargs="*", default=[10, 100, 1000],
+                        help="synthetic scale factors applied to the base file")
+    parser.add_argument("--scale-base", default=SCALE_BASE, help="CSV the synthetic datasets are built from")
+    parser.add_argument("--generated", type=int, nargs="*", default=[],
+                        help="row counts of synthetic_chains datasets (dirty names and headers) to add")
+    parser.add_argument("--only", help="only run datasets whose path contains this text")
+    parser.add_argument("--compare", help="results file to compare with (default: the latest earlier run)")
+    args = parser.parse_args()
+
+    rows = []
+    paths = sorted(p for pattern in DATASET_GLOBS for p in glob.glob(pattern))
+    for path in paths:
+        if args.only and args.only not in path:
+            continue
+        rows += run_dataset(path, load_chain_csv(path), direction_of(path), args.repeat, path)
+
+    base = load_chain_csv(args.scale_base)
+    for factor in args.scales:
+        name = f"synthetic {factor}x {args.scale_base}"
+        if args.only and args.only not in name:
+            continue
+        rows += run_dataset(name, scale_frame(base, factor), direction_of(args.scale_base), args.scale_repeat)
+
+    for n_rows in args.generated:
+        name = f"generated {n_rows} rows"
+        if args.only and args.only not in name:
+            continue
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "chains.csv")
+            write_csv(generate_frame(n_rows, customers=max(100, n_rows // 200), dirty=0.01), path, dirty_headers=True)
+            rows += run_dataset(name, load_chain_csv(path), "upstream", args.scale_repeat, path)
+
+    version = git_version()
+    path = save_results(rows, version)
+    print(f"\nSaved {len(rows)} results to {path}")
+
+    baseline = args.compare or latest_results(exclude=path)
+    if baseline:
+        compare(rows, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""Headless HTTP API serving icicle tree arrays to external frontends.
+
+    python chart_api.py     # listens on CHART_API_HOST:CHART_API_PORT (default 127.0.0.1:8502)
+
+    GET /tree?direction=upstream&duration=1%20Month&customer-id=1073&hop=Hop%202
+    GET /metrics
+
+``customer-id`` or ``customer-name`` picks the customer (default "All Customers") and
+``hop`` ("All Hops" or "Hop N") only applies to upstream trees. The response is JSON
+with ``labels, parents, values, ids, totals`` (node ``i`` at position ``i``, the root's
+parent ``null``), or with ``format=arrow`` an Arrow IPC stream with one row per node.
+
+Trees come from ``chart_cache.chart`` with the partner page's options, so they are
+cached, coalesced and built in the pool exactly like the dashboard's. The ETag is
+derived from the chart key, which carries the CSV's mtime and size: clients
+revalidating with ``If-None-Match`` get a 304 without any tree being built until
+``cron_icicle.py`` publishes new data.
+
+Auth mirrors the partner page. With ``ICICLE_API_KEY`` set a request needs either that
+key in ``x-api-key`` or a partner ``token`` (query or ``Authorization: Bearer``) that the
+token service accepts, and a token only ever sees its own customer. ``/metrics``
+needs the key itself.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from dotenv import load_dotenv
+
+import metrics
+from chart_cache import LRUCache, PARTNER_CHART_OPTIONS, chart, chart_key, start_prewarmer
+from chart_data import DURATIONS, chain_csv_path
+from chart_engine import ALL_CUSTOMERS, MAX_HOPS, deep_clean
+from customer_aliases import resolve_id, resolve_name
+from metrics import API_SECONDS, TOKEN_SECONDS
+
+
+logger = logging.getLogger("icicle.api")
+
+CONTENT_TYPES = {"json": "application/json", "arrow": "application/vnd.apache.arrow.stream"}
+HOP_FILTERS = ["All Hops"] + [f"Hop {i}" for i in range(1, MAX_HOPS + 1)]
+
+BODIES = LRUCache("api_bodies", int(os.getenv("API_CACHE_SIZE", "256")))
+# Validated tokens are trusted for up to TOKEN_CACHE_SECONDS instead of asking the token service on every embed
+TOKENS = LRUCache("api_tokens", 4096)
+TOKEN_CACHE_SECONDS = int(os.getenv("TOKEN_CACHE_SECONDS", "60"))
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# ---------------------- Authentication ----------------------
+
+def validate_token(token):
+    """Return ``(customer_id, expires_at)`` from the token service, or None if it rejects the token"""
+    def ask():
+        started = time.perf_counter()
+        try:
+            response = requests.post(
+                os.getenv("VALIDATION_ENDPOINT"),
+                json={"token": token},
+                headers={"x-api-key": os.getenv("ICICLE_API_KEY"), "Content-Type": "application/json"},
+                timeout=10
+            )
+        except requests.RequestException as e:
+            TOKEN_SECONDS.observe(time.perf_counter() - started, result="error")
+            raise ApiError(502, f"token validation failed: {e}")
+        TOKEN_SECONDS.observe(time.perf_counter() - started, result=str(response.status_code))
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        return data.get("customer_id"), data.get("expires_at")
+
+    return TOKENS.fetch((token, int(time.time() // TOKEN_CACHE_SECONDS)), ask)
+
+
+def has_api_key(headers, expected_secret):
+    """Constant-time check of the ``x-api-key`` header"""
+    # Bytes, because compare_digest rejects non-ASCII str and header values can be anything
+    return hmac.compare_digest(headers.get("x-api-key", "").encode(), expected_secret.encode())
+
+
+def authorize(headers, params):
+    """Return the customer id a token is limited to, or None for full access"""
+    expected_secret = os.getenv("ICICLE_API_KEY")
+    if not expected_secret:
+        return None
+    if has_api_key(headers, expected_secret):
+        return None
+
+    token = params.get("token")
+    authorization = headers.get("Authorization", "")
+    if not token and authorization.startswith("Bearer "):
+        token = authorization[len("Bearer "):]
+    if not token:
+        raise ApiError(401, "an API key or token is required")
+
+    validated = validate_token(token)
+    if validated is None or not validated[0]:
+        raise ApiError(401, "invalid or expired token")
+    customer_id, expires_at = validated
+    if expires_at and time.time() > expires_at:
+        raise ApiError(401, "token has expired")
+    return customer_id
+
+
+# ---------------------- Request Parsing ----------------------
+
+def resolve_customer(params, token_customer_id):
+    """Return the cleaned customer name a request is for, looked up in the alias table like the partner page"""
+    customer_id = params.get("customer-id")
+    if token_customer_id is not None:
+        if customer_id is not None and str(customer_id) != str(token_customer_id):
+            raise ApiError(403, "token is not valid for this customer")
+        customer_id = token_customer_id
+
+    if customer_id is not None:
+        try:
+            customer_id = int(customer_id)
+        except ValueError:
+            raise ApiError(400, f"invalid customer id '{customer_id}', expected a number")
+        name = resolve_id(customer_id)
+        if name is None:
+            raise ApiError(404, f"customer id {customer_id} not found")
+        return name
+
+    name = params.get("customer-name")
+    if not name:
+        return ALL_CUSTOMERS
+    resolved = resolve_name(name)
+    if resolved is None:
+        raise ApiError(404, f"customer '{deep_clean(name)}' not found")
+    return resolved
+
+
+def tree_request(params, token_customer_id):
+    direction = params.get("direction", "upstream")
+    if direction not in PARTNER_CHART_OPTIONS:
+        raise ApiError(400, "direction must be 'upstream' or 'downstream'")
+    duration = params.get("duration", DURATIONS[0])
+    if duration not in DURATIONS:
+        raise ApiError(400, f"duration must be one of {DURATIONS}")
+    hop_filter = params.get("hop", "All Hops") if direction == "upstream" else "All Hops"
+    if hop_filter not in HOP_FILTERS:
+        raise ApiError(400, f"hop must be one of {HOP_FILTERS}")
+    fmt = params.get("format", "json")
+    if fmt not in CONTENT_TYPES:
+        raise ApiError(400, f"format must be one of {list(CONTENT_TYPES)}")
+    return direction, duration, resolve_customer(params, token_customer_id), hop_filter, fmt
+
+
+# ---------------------- Encoding ----------------------
+
+def json_body(meta, labels, parents, values, ids, totals):
+    return json.dumps(
+        dict(meta, labels=labels, parents=parents, values=values, ids=ids, totals=totals),
+        separators=(",", ":")
+    ).encode()
+
+
+def arrow_body(meta, labels, parents, values, ids, totals):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ApiError(406, "format=arrow needs pyarrow installed on the server")
+    table = pa.table({
+        "id": pa.array(ids, pa.int32()),
+        "parent": pa.array(parents, pa.int32()),
+        "label": pa.array(labels, pa.string()),
+        "value": pa.array(values, pa.int64()),
+        "total": pa.array(totals, pa.int64()),
+    }).replace_schema_metadata({key: str(value) for key, value in meta.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def tree_response(direction, duration, selected_customer, hop_filter, fmt, etags=()):
+    """Return ``(etag, body)``; body is None when one of ``etags`` is still current"""
+    path = chain_csv_path(direction, duration, selected_customer)
+    options = PARTNER_CHART_OPTIONS[direction]
+    try:
+        key = chart_key(path, direction, selected_customer, hop_filter, **options)
+    except FileNotFoundError:
+        raise ApiError(404, f"no {direction} data for {duration}")
+    etag = '"' + hashlib.sha1(repr((key, fmt)).encode()).hexdigest()[:20] + '"'
+    if etag in etags or "*" in etags:
+        return etag, None
+
+    def encode():
+        labels, parents, values, ids, totals, _ = chart(path, direction, selected_customer, hop_filter, **options)
+        meta = {
+            "direction": direction, "duration": duration, "customer": selected_customer,
+            "hop_filter": hop_filter, "etag": etag.strip('"')
+        }
+        encoder = arrow_body if fmt == "arrow" else json_body
+        return encoder(meta, labels, parents, values, ids, totals)
+
+    return etag, BODIES.fetch((key, fmt), encode)
+
+
+# ---------------------- HTTP Server ----------------------
+
+class ChartApiHandler(BaseHTTPRequestHandler):
+    server_version = "IcicleChartApi/1.0"
+
+    def do_GET(self):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        status = 500
+        try:
+            if url.path == "/tree":
+                status = self.send_tree({key: values[-1] for key, values in parse_qs(url.query).items()})
+            elif url.path == "/metrics":
+                self.authorize_metrics()
+                status = self.send_body(200, metrics.render().encode(), "text/plain; version=0.0.4")
+            else:
+                raise ApiError(404, f"no route {url.path}")
+        except ApiError as e:
+            status = self.send_error_json(e.status, e.message)
+        except Exception:
+            logger.exception("request failed: %s", self.path)
+            status = self.send_error_json(500, "internal error")
+        finally:
+            route = url.path if url.path in ("/tree", "/metrics") else "other"
+            API_SECONDS.observe(time.perf_counter() - started, route=route, status=str(status))
+
+    def do_OPTIONS(self):
+        # CORS preflight for portals sending x-api-key / Authorization from the browser
+        self.send_response(204)
+        self.send_cors_headers()
+        self.send_header("Access-Control-Allow-Methods", "GET, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Authorization, x-api-key, If-None-Match")
+        self.end_headers()
+
+    def authorize_metrics(self):
+        # Traffic per route and status is operator data: the API key only, never a partner token
+        expected_secret = os.getenv("ICICLE_API_KEY")
+        if expected_secret and not has_api_key(self.headers, expected_secret):
+            raise ApiError(401, "/metrics needs the API key")
+
+    def send_tree(self, params):
+        token_customer_id = authorize(self.headers, params)
+        etags = [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",") if tag.strip()]
+        etag, body = tree_response(*tree_request(params, token_customer_id), etags=etags)
+        cache_headers = {
+            "ETag": etag,
+            "Cache-Control": f"private, max-age={os.getenv('CHART_API_MAX_AGE', '60')}, must-revalidate",
+        }
+        if body is None:
+            return self.send_body(304, b"", headers=cache_headers)
+        return self.send_body(200, body, CONTENT_TYPES[params.get("format", "json")], cache_headers)
+
+    def send_error_json(self, status, message):
+        return self.send_body(status, json.dumps({"error": message}).encode(), CONTENT_TYPES["json"])
+
+    def send_body(self, status, body, content_type=None, headers=None):
+        self.send_response(status)
+        self.send_cors_headers()
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        return status
+
+    def send_cors_headers(self):
+        allow_origin = os.getenv("CHART_API_ALLOW_ORIGIN")
+        if allow_origin:
+            self.send_header("Access-Control-Allow-Origin", allow_origin)
+            self.send_header("Access-Control-Expose-Headers", "ETag")
+            self.send_header("Vary", "Origin")
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    start_prewarmer()
+    host = os.getenv("CHART_API_HOST", "127.0.0.1")
+    port = int(os.getenv("CHART_API_PORT", "8502"))
+    server = ThreadingHTTPServer((host, port), ChartApiHandler)
+    logger.info("chart API listening on %s:%d", host, port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""Process-wide cache of loaded frames and built icicle trees, and the prewarm worker.
+
+Every Streamlit session in a process reads from the same LRU caches:
+
+* ``load_frame(path)`` - the lean frame from ``load_chain_csv``, optionally stripped
+* ``chart(path, direction, customer, ...)`` - the ``build_*_chart`` arrays
+* ``figure(key, build)`` - finished Plotly figures, keyed by ``chart_key`` plus view
+* ``records(path, customer)`` - a customer's rows in display order, for paging
+* ``positions(path, chart_type, customer)`` - ``analyze_positions`` of a customer's rows
+
+Keys include each file's mtime and size, so a refresh by ``cron_icicle.py`` is
+picked up without restarting. Cached frames, arrays and figures are shared
+between sessions and must be treated as read-only.
+
+Misses are single-flight: when several sessions ask for the same missing entry at
+once (a partner link going round after the month-end email), one of them builds
+it and the rest wait for that result instead of building their own copy.
+
+``start_prewarmer()`` runs a daemon thread that watches the dataset version and,
+whenever it changes, builds "All Customers" plus the ``PREWARM_TOP_N`` customers
+by event volume for every duration, so the first partner after a refresh gets a
+warm chart.
+
+Chart misses are built in the ``chart_pool`` worker processes, which keep their
+own frame cache, so only the path and options go in and only arrays come back.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import chart_pool
+
+from chart_engine import (
+    ALL_CUSTOMERS, analyze_positions, build_upstream_chart, build_downstream_chart, filter_customer
+)
+from chart_data import DURATIONS, chain_csv_path, load_chain_csv, record_order, strip_names
+from metrics import CACHE_COALESCED, CACHE_LOOKUPS, CACHE_MISSES
+from perf_trace import NULL_TIMER
+
+
+logger = logging.getLogger("icicle.cache")
+
+# Options the partner flow page builds its charts with
+PARTNER_CHART_OPTIONS = {"upstream": {}, "downstream": {"hop_labels": False}}
+
+_MISSING = object()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.abandoned = False
+
+
+class SingleFlight:
+    """Coalesce concurrent computations of the same key into one.
+
+    The first caller of ``do(key, fn)`` runs ``fn``; callers arriving while it runs
+    wait and get the same result or exception, calling ``wait()`` every ``poll``
+    seconds as in ``chart_pool.run``. If the running caller is interrupted instead
+    (Streamlit's stop/rerun exceptions are not ``Exception``s), a waiter takes over.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn, wait=None, poll=0.1):
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = _Flight()
+            if leader:
+                return self._lead(key, flight, fn)
+
+            CACHE_COALESCED.inc(cache=self.name)
+            while not flight.done.wait(poll):
+                if wait is not None:
+                    wait()
+            if flight.error is not None:
+                raise flight.error
+            if not flight.abandoned:
+                return flight.value
+
+    def _lead(self, key, flight, fn):
+        try:
+            flight.value = fn()
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        except BaseException:
+            flight.abandoned = True
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+
+class LRUCache:
+    def __init__(self, name, max_entries):
+        self.name = name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.flights = SingleFlight(name)
+
+    def get(self, key):
+        CACHE_LOOKUPS.inc(cache=self.name)
+        with self.lock:
+            value = self.entries.get(key, _MISSING)
+            if value is not _MISSING:
+                self.entries.move_to_end(key)
+        if value is _MISSING:
+            CACHE_MISSES.inc(cache=self.name)
+        return value
+
+    def fetch(self, key, build, wait=None):
+        """Return the entry for ``key``, calling ``build()`` once however many callers miss together"""
+        value = self.get(key)
+        if value is _MISSING:
+            value = self.flights.do(key, lambda: self._fill(key, build), wait)
+        return value
+
+    def _fill(self, key, build):
+        with self.lock:
+            # A flight that finished between our miss and now has already stored it
+            value = self.entries.get(key, _MISSING)
+        if value is _MISSING:
+            value = build()
+            self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def retain(self, keep):
+        """Drop every entry whose key fails ``keep(key)``"""
+        with self.lock:
+            for key in [key for key in self.entries if not keep(key)]:
+                del self.entries[key]
+
+
+FRAMES = LRUCache("frames", int(os.getenv("FRAME_CACHE_SIZE", "32")))
+CHARTS = LRUCache("charts", int(os.getenv("CHART_CACHE_SIZE", "512")))
+FIGURES = LRUCache("figures", int(os.getenv("FIGURE_CACHE_SIZE", "64")))
+RECORDS = LRUCache("records", int(os.getenv("RECORDS_CACHE_SIZE", "128")))
+POSITIONS = LRUCache("positions", int(os.getenv("POSITIONS_CACHE_SIZE", "128")))
+
+
+def file_signature(path):
+    """``(path, mtime_ns, size)``; raises FileNotFoundError like ``read_csv`` would"""
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def load_frame(path, strip=False, timer=NULL_TIMER):
+    """Return the shared lean frame for ``path``; ``strip=True`` applies ``strip_names``"""
+    def load():
+        df = load_chain_csv(path, timer)
+        if strip:
+            strip_names(df, timer)
+        return df
+
+    return FRAMES.fetch((file_signature(path), strip), load)
+
+
+def build_from_file(path, direction, selected_customer, hop_filter, options, timer=NULL_TIMER):
+    """Build one chart from its CSV; runs in a pool worker or, without a pool, inline"""
+    df = load_frame(path, timer=timer)
+    if direction == "upstream":
+        return build_upstream_chart(df, selected_customer, hop_filter, **options)
+    return build_downstream_chart(df, selected_customer, **options)
+
+
+def chart_key(path, direction, selected_customer=ALL_CUSTOMERS, hop_filter="All Hops", **options):
+    return file_signature(path), direction, selected_customer, hop_filter, tuple(sorted(options.items()))
+
+
+def chart(path, direction, selected_customer=ALL_CUSTOMERS, hop_filter="All Hops", timer=NULL_TIMER,
+          wait=None, **options):
+    """Return the cached ``build_*_chart`` arrays for ``path``, building them on a miss.
+
+    ``wait`` is called periodically while a pool worker or another session builds the
+    chart (see ``chart_pool.run``).
+    """
+    key = chart_key(path, direction, selected_customer, hop_filter, **options)
+    args = (path, direction, selected_customer, hop_filter, options)
+
+    def build():
+        if chart_pool.enabled():
+            return chart_pool.run(key, build_from_file, args, wait=wait)
+        return build_from_file(*args, timer=timer)
+
+    return CHARTS.fetch(key, build, wait=wait)
+
+
+def figure(key, build, wait=None):
+    """Return the shared figure for ``key``, calling ``build()`` on a miss.
+
+    ``key`` starts with the ``chart_key`` the figure was drawn from, followed by whatever
+    else shapes it (drill-down, title, ...). ``st.plotly_chart`` only reads the figure,
+    so one object can be rendered by every session, but nobody may update it.
+    """
+    return FIGURES.fetch(key, build, wait=wait)
+
+
+def records(path, selected_customer=ALL_CUSTOMERS, wait=None):
+    """Return ``(frame, positions, total_events)``: the shared frame of ``path`` and
+    ``record_order`` for ``selected_customer``, sorted once per file version.
+    """
+    df = load_frame(path)
+    positions, total_events = RECORDS.fetch(
+        (file_signature(path), selected_customer), lambda: record_order(df, selected_customer), wait=wait
+    )
+    return df, positions, total_events
+
+
+def positions(path, chart_type, selected_customer, wait=None):
+    """Return ``analyze_positions`` for ``selected_customer``'s rows of ``path``, computed once per file version"""
+    def build():
+        return analyze_positions(filter_customer(load_frame(path), selected_customer), chart_type, selected_customer)
+
+    return POSITIONS.fetch((file_signature(path), chart_type, selected_customer), build, wait=wait)
+
+
+# ---------------------- Prewarming ----------------------
+
+def dataset_paths():
+    return sorted({
+        chain_csv_path(direction, duration, customer)
+        for direction in ("upstream", "downstream")
+        for duration in DURATIONS
+        for customer in (ALL_CUSTOMERS, None)
+    })
+
+
+def dataset_version():
+    """Signature of every published chain CSV; changes whenever one is rewritten"""
+    version = []
+    for path in dataset_paths():
+        try:
+            version.append(file_signature(path))
+        except FileNotFoundError:
+            continue
+    return tuple(version)
+
+
+def top_customers(df, n):
+    """Return the cleaned names of the ``n`` customers with the most events"""
+    totals = df.groupby('customer_cleaned', observed=True)['event_count'].sum()
+    return [name for name in totals.nlargest(n).index if name]
+
+
+def prewarm(top_n=20, durations=DURATIONS):
+    """Build the partner page charts for "All Customers" and the top customers of every duration.
+
+    Charts are requested concurrently so the pool's workers are all kept busy.
+    """
+    jobs = []
+    for duration in durations:
+        for direction, options in PARTNER_CHART_OPTIONS.items():
+            try:
+                jobs.append((chain_csv_path(direction, duration), direction, ALL_CUSTOMERS, options))
+                shifted_path = chain_csv_path(direction, duration, selected_customer=None)
+                for customer in top_customers(load_frame(shifted_path), top_n):
+                    jobs.append((shifted_path, direction, customer, options))
+            except FileNotFoundError as e:
+                logger.warning("prewarm skipped %s %s: %s", direction, duration, e)
+
+    def build(job):
+        path, direction, customer, options = job
+        try:
+            chart(path, direction, customer, **options)
+            return 1
+        except FileNotFoundError as e:
+            logger.warning("prewarm skipped %s: %s", path, e)
+            return 0
+
+    with ThreadPoolExecutor(max_workers=max(1, chart_pool.workers())) as threads:
+        return sum(threads.map(build, jobs))
+
+
+def drop_stale(version):
+    """Forget frames, charts and figures built from files that have since been replaced"""
+    current = set(version)
+    FRAMES.retain(lambda key: key[0] in current)
+    CHARTS.retain(lambda key: key[0] in current)
+    RECORDS.retain(lambda key: key[0] in current)
+    POSITIONS.retain(lambda key: key[0] in current)
+    FIGURES.retain(lambda key: key[0][0] in current)
+
+
+class Prewarmer(threading.Thread):
+    def __init__(self, top_n, interval):
+        super().__init__(name="icicle-prewarm", daemon=True)
+        self.top_n = top_n
+        self.interval = interval
+        self.version = None
+
+    def run(self):
+        # Launch the chart pool here, outside any session
+        try:
+            chart_pool.start()
+        except Exception:
+            logger.exception("chart pool failed to start; workers will start on first use")
+        while True:
+            version = dataset_version()
+            if version != self.version:
+                started = time.perf_counter()
+                try:
+                    drop_stale(version)
+                    built = prewarm(self.top_n)
+                    self.version = version
+                    logger.info("prewarmed %d charts in %.1f s", built, time.perf_counter() - started)
+                except Exception:
+                    logger.exception("prewarm failed")
+            time.sleep(self.interval)
+
+
+_prewarmer = None
+_prewarmer_lock = threading.Lock()
+
+
+def start_prewarmer():
+    """Start the prewarm thread once per process (``PREWARM_ENABLED=False`` turns it off)"""
+    global _prewarmer
+    if os.getenv("PREWARM_ENABLED", "True") != "True":
+        return None
+    with _prewarmer_lock:
+        if _prewarmer is None:
+            _prewarmer = Prewarmer(
+                top_n=int(os.getenv("PREWARM_TOP_N", "20")),
+                interval=float(os.getenv("PREWARM_INTERVAL", "60"))
+            )
+            _prewarmer.start()
+    return _prewarmer
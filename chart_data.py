@@ -0,0 +1,170 @@
+"""Loading and customer discovery for the chain CSVs.
+
+Like chart_engine this module has no Streamlit dependency, so the pages,
+scripts and benchmarks all read the files the same way.
+"""
+import numpy as np
+import pandas as pd
+
+from chart_engine import ALL_CUSTOMERS, MAX_HOPS, clean_key, clean_val, deep_clean, safe_int
+from perf_trace import NULL_TIMER
+
+
+DURATIONS = ["1 Month", "3 Months", "6 Months", "1 Year"]
+_DURATION_SUFFIX = {"1 Month": "1month", "3 Months": "3month", "6 Months": "6month", "1 Year": "1year"}
+DURATION_MONTHS = {"1 Month": 1, "3 Months": 3, "6 Months": 6, "1 Year": 12}
+
+
+def chain_csv_path(direction, duration, selected_customer=ALL_CUSTOMERS):
+    """Return the extracted CSV behind one chart.
+
+    "All Customers" reads the original files; a specific customer reads the shifted
+    files, where every chain is re-rooted at its customer.
+    """
+    suffix = _DURATION_SUFFIX[duration]
+    if selected_customer == ALL_CUSTOMERS:
+        if direction == "upstream":
+            return f"upstream_duration/up_{suffix}_data.csv"
+        return f"duration/{suffix}_data.csv"
+    return f"shifted_{direction}_duration/shifted_{direction}_duration_{suffix}.csv"
+
+
+NAME_COLUMNS = ['customer'] + [f'customer_{i}' for i in range(1, MAX_HOPS + 1)]
+# The per-hop ``customer_{i}_id`` columns are never read, so they are not loaded at all
+KEEP_COLUMNS = {'event_count', 'event_id', 'customer_id', *NAME_COLUMNS}
+
+
+def load_chain_csv(path, timer=NULL_TIMER):
+    """Read a chain CSV and add ``original_customer``, ``customer_cleaned`` and ``customer_id``.
+
+    Only ``KEEP_COLUMNS`` are loaded and the frame is stored lean, see ``lean_frame``.
+    Reading and cleaning are timed as the ``csv_load`` and ``clean`` spans of ``timer``.
+    """
+    with timer.span("csv_load", path=path):
+        df = pd.read_csv(path, usecols=lambda col: clean_key(col) in KEEP_COLUMNS)
+
+    with timer.span("clean", path=path):
+        df.columns = [clean_key(col) for col in df.columns]
+        df = lean_frame(df)
+    return df
+
+
+def lean_frame(df):
+    """Return ``df`` with compact dtypes and the derived customer columns.
+
+    Names become categoricals that share one dictionary across the base and hop
+    columns, so each distinct partner string is stored once. ``original_customer``
+    is a second set of codes on that dictionary rather than a copy of the strings,
+    and ``customer_cleaned`` has its own small dictionary of cleaned names.
+    ``event_count`` becomes int32 (int64 if needed) and ``customer_id`` an integer column.
+    """
+    df = df.copy()
+    names = [col for col in NAME_COLUMNS if col in df.columns]
+    df[names] = df[names].astype(object).fillna('')
+    shared = pd.CategoricalDtype(pd.unique(df[names].to_numpy().ravel()))
+    for col in names:
+        df[col] = df[col].astype(shared)
+
+    counts = df['event_count']
+    if counts.dtype == object:
+        counts = counts.map(safe_int)
+    counts = counts.fillna(0).astype('int64')
+    if counts.empty or counts.abs().max() < 2 ** 31:
+        counts = counts.astype('int32')
+    df['event_count'] = counts
+
+    df['original_customer'] = df['customer']
+    df['customer_cleaned'] = map_names(df['customer'], lambda name: deep_clean(str(name)))
+
+    # Add customer_id if it doesn't exist
+    if 'customer_id' not in df.columns:
+        df['customer_id'] = map_names(df['customer_cleaned'], lambda x: abs(hash(x)) % 10000).astype('int64')
+    else:
+        ids = pd.to_numeric(df['customer_id'], errors='coerce')
+        df['customer_id'] = ids.astype('Int64') if ids.isna().any() else ids.astype('int64')
+    return df
+
+
+def map_names(column, fn):
+    """Apply ``fn`` to each distinct value of a categorical ``column`` once, keeping it categorical"""
+    mapped = column.cat.categories.map(fn)
+    uniques = pd.unique(mapped)
+    positions = pd.Index(uniques).get_indexer(mapped)
+    codes = column.cat.codes.to_numpy()
+    return pd.Series(
+        pd.Categorical.from_codes(positions[codes], categories=uniques),
+        index=column.index, name=column.name
+    )
+
+
+def strip_names(df, timer=NULL_TIMER):
+    """Strip whitespace from the base customer and every hop column in place"""
+    with timer.span("clean", step="strip_names"):
+        names = [col for col in NAME_COLUMNS if col in df.columns]
+        if all(isinstance(df[col].dtype, pd.CategoricalDtype) for col in names):
+            # Strip the shared dictionary once, then re-share the stripped one
+            stripped = pd.concat([map_names(df[col], lambda name: clean_val(str(name))) for col in names], axis=1)
+            shared = pd.CategoricalDtype(pd.unique(stripped.to_numpy().ravel()))
+            for col in names:
+                df[col] = stripped[col].astype(shared)
+        else:
+            for col in names:
+                df[col] = df[col].astype(str).apply(clean_val)
+    return df
+
+
+def record_order(df, selected_customer=ALL_CUSTOMERS):
+    """Return ``(positions, total_events)`` for ``records_page``.
+
+    ``positions`` are the row positions in ``df`` of ``selected_customer``'s rows,
+    heaviest first, and ``total_events`` their event count.
+    """
+    counts = df['event_count'].to_numpy()
+    if selected_customer == ALL_CUSTOMERS:
+        positions = np.arange(len(df))
+    else:
+        positions = np.flatnonzero((df['customer_cleaned'] == deep_clean(selected_customer)).to_numpy())
+    positions = positions[(-counts[positions]).argsort(kind='stable')]
+    return positions, int(counts[positions].sum())
+
+
+def records_page(df, positions, total_events, page, page_size=50):
+    """Return page ``page`` (from 0) of the rows ``record_order`` picked, for display.
+
+    Only the visible rows are selected and given their ``percentage``, and ``df``
+    itself is never copied or modified.
+    """
+    columns = [
+        col for col in df.columns
+        if col == 'event_count'
+        or (col.startswith('customer_') and not col.endswith('_id') and col != 'customer_cleaned')
+    ]
+    rows = positions[page * page_size:(page + 1) * page_size]
+    table = df.iloc[rows, [df.columns.get_loc(col) for col in columns]]
+
+    table.insert(len(columns), 'percentage', (
+        table['event_count'] / (total_events or 1) * 100
+    ).round(2).astype(str) + '%')
+    return table
+
+
+def customer_directory(*dfs):
+    """Return ``{cleaned name: (display name, customer_id)}`` ordered by cleaned name.
+
+    When a customer appears in several frames the first frame wins.
+    """
+    first_seen = pd.concat(
+        [df[['customer_cleaned', 'original_customer', 'customer_id']] for df in dfs]
+    ).drop_duplicates('customer_cleaned')
+    return {
+        row.customer_cleaned: (row.original_customer, row.customer_id)
+        for row in first_seen.sort_values('customer_cleaned').itertuples(index=False)
+    }
+
+
+def customer_names(*dfs):
+    """Return the sorted union of base customer names across ``dfs``"""
+    names = set()
+    for df in dfs:
+        names |= {clean_val(str(name)) for name in df['customer'].dropna().unique()}
+    return sorted(names)
@@ -0,0 +1,601 @@
+"""Chain aggregation and icicle tree engine shared by both dashboard pages.
+
+Plain data in, plain arrays out: nothing here touches Streamlit, so the same
+code backs the partner-flow page, the hop-level page and offline scripts.
+"""
+import heapq
+import re
+from collections import defaultdict
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+
+ALL_CUSTOMERS = "All Customers"
+MAX_HOPS = 6
+
+_ZERO_WIDTH = re.compile(r'[\u200B-\u200D\uFEFF]')
+
+
+# ---------------------- Value helpers ----------------------
+
+def clean_key(k):
+    return k.strip().strip('"').strip()
+
+
+def clean_val(v):
+    if not v or not isinstance(v, str):
+        return ''
+    return v.strip()
+
+
+def safe_int(val):
+    try:
+        return int(str(val).replace(',', '').strip())
+    except Exception:
+        return 0
+
+
+def deep_clean(s):
+    if not isinstance(s, str):
+        return ''
+    s = _ZERO_WIDTH.sub('', s)
+    s = s.encode('ascii', errors='ignore').decode()
+    return s.strip().lower()
+
+
+def hop_depth(hop_filter):
+    """Map an "All Hops" / "Hop N" selection to the number of hops to keep"""
+    if hop_filter == "All Hops":
+        return MAX_HOPS
+    return int(hop_filter.split()[1])
+
+
+# ---------------------- Chain aggregation ----------------------
+
+def filter_customer(df, selected_customer):
+    """Return the rows whose cleaned base customer is ``selected_customer``"""
+    if selected_customer == ALL_CUSTOMERS:
+        return df
+    if 'customer_cleaned' in df.columns:
+        cleaned = df['customer_cleaned']
+    else:
+        cleaned = df['customer'].astype(str).map(deep_clean)
+    return df[cleaned == deep_clean(selected_customer)]
+
+
+def chain_contains(df, selected_customer):
+    """Check whether ``selected_customer`` (cleaned) is the base or any hop of some row.
+
+    Only the distinct values of each column are cleaned, so no cleaned copies are stored.
+    """
+    for col in ['customer'] + [f'customer_{i}' for i in range(1, MAX_HOPS + 1)]:
+        if col in df.columns and any(deep_clean(str(v)) == selected_customer for v in df[col].unique()):
+            return True
+    return False
+
+
+def chain_records(df, base_key='customer'):
+    """Yield one small dict per row with ``event_count``, ``base_key`` and the hop names.
+
+    A lazy, column-pruned replacement for ``df.to_dict(orient='records')``: only the
+    columns ``record_chain`` reads are touched and no list of row dicts is built.
+    """
+    keys = [key for key in ['event_count', base_key] + [f'customer_{i}' for i in range(1, MAX_HOPS + 1)]
+            if key in df.columns]
+    for values in zip(*(df[key].to_numpy() for key in keys)):
+        yield dict(zip(keys, values))
+
+
+def record_chain(record, base_key='customer'):
+    """Return ``[base, hop 1, hop 2, ...]`` for one row, skipping empty hops"""
+    chain = [clean_val(record.get(base_key, ''))]
+    for i in range(1, MAX_HOPS + 1):
+        cust = clean_val(record.get(f'customer_{i}', ''))
+        if cust:
+            chain.append(cust)
+    return chain
+
+
+def aggregate_paths(records, max_hops=MAX_HOPS, min_hops=0, base_key='customer'):
+    """Sum event counts per root-to-leaf chain.
+
+    ``records`` is an iterable of row dicts, usually ``chain_records(df)``.
+    Rows without a base customer or events are skipped, chains are cut after
+    ``max_hops`` hops and chains with fewer than ``min_hops`` hops are dropped.
+    """
+    aggregated = defaultdict(int)
+    for record in records:
+        event_count = safe_int(record.get('event_count', 0))
+        if event_count == 0:
+            continue
+
+        chain = record_chain(record, base_key)
+        if not chain[0] or len(chain) - 1 < min_hops:
+            continue
+
+        aggregated[tuple(chain[:max_hops + 1])] += event_count
+    return aggregated
+
+
+# ---------------------- Hop filtering ----------------------
+
+def deepest_hop(df, selected_customer):
+    """Return the deepest unbroken run of hops after ``selected_customer`` in any row"""
+    max_depth = 0
+    for _, row in df.iterrows():
+        if deep_clean(row['customer']) == selected_customer:
+            start = 1
+        else:
+            # If selected customer appears later in chain, count from that position
+            start = next(
+                (i + 1 for i in range(1, MAX_HOPS + 1)
+                 if deep_clean(str(row.get(f'customer_{i}', ''))) == selected_customer),
+                None
+            )
+            if start is None:
+                continue
+
+        hop_count = 0
+        for i in range(start, MAX_HOPS + 1):
+            if row.get(f'customer_{i}') and str(row.get(f'customer_{i}')).strip():
+                hop_count += 1
+            else:
+                break
+        max_depth = max(max_depth, hop_count)
+    return max_depth
+
+
+def hop_options(df, selected_customer):
+    """Return ``({hop: partner names}, max_hop)`` for chains rooted at ``selected_customer``"""
+    hop_map = defaultdict(set)
+    max_hop = 0
+    selected_cleaned = deep_clean(selected_customer)
+    for row in df.itertuples():
+        if deep_clean(row.customer) != selected_cleaned:
+            continue
+        chain = [row.customer] + [getattr(row, f"customer_{i}", '') for i in range(1, MAX_HOPS + 1)]
+        chain = [c for c in chain if c.strip()]
+        for hop_offset, name in enumerate(chain[1:], start=1):
+            hop_map[hop_offset].add(name)
+            max_hop = max(max_hop, hop_offset)
+    return hop_map, max_hop
+
+
+def chain_matches(row, hop_filters, selected_customer):
+    """Check that ``row`` is rooted at ``selected_customer`` (cleaned) and passes ``hop_filters``"""
+    active_hops = {k: v for k, v in hop_filters.items() if v}
+    chain = [row['customer']] + [row.get(f'customer_{i}', '') for i in range(1, MAX_HOPS + 1)]
+    chain = [c for c in chain if c.strip()]
+
+    try:
+        pos = next(i for i, val in enumerate(chain) if deep_clean(val) == selected_customer)
+        if pos != 0:
+            return False  # Only allow root match
+    except StopIteration:
+        return False
+
+    if not active_hops:
+        return True  # ✅ Accept all chains rooted at customer
+
+    max_specified = max(active_hops.keys(), default=0)
+    for hop in range(1, max_specified + 1):
+        expected = active_hops.get(hop, [])
+        idx = pos + hop
+        if idx >= len(chain):
+            return False
+        if expected and deep_clean(chain[idx]) not in {deep_clean(x) for x in expected}:
+            return False
+
+    return True
+
+
+def filter_hops(df, hop_filters, selected_customer):
+    """Return the rows of ``df`` accepted by ``chain_matches``"""
+    if selected_customer == ALL_CUSTOMERS:
+        return df
+    if df.empty:
+        return df
+    selected_cleaned = deep_clean(selected_customer)
+    return df[df.apply(lambda row: chain_matches(row, hop_filters, selected_cleaned), axis=1)]
+
+
+# ---------------------- Validation ----------------------
+
+def validate_tree_data(df, chart_type, selected_customer):
+    """Return ``(raw_total, tree_total, difference)`` for the rows behind one chart.
+
+    Reads the loaded frame as is: rows are picked with masks and ``customer_cleaned``
+    is reused, so the frame is neither copied nor cleaned again.
+    """
+    base_key = 'customer' if chart_type == "upstream" else 'original_customer'
+    if selected_customer != ALL_CUSTOMERS:
+        # customer_cleaned is derived from the base customer before any stripping, so it
+        # matches the cleaned original_customer too
+        if 'customer_cleaned' in df.columns:
+            cleaned = df['customer_cleaned']
+        else:
+            cleaned = df[base_key].astype(str).map(deep_clean)
+        df = df[cleaned == selected_customer]
+
+    duplicated = df.duplicated(subset=['event_id']) if 'event_id' in df.columns else df.duplicated()
+    if duplicated.any():
+        df = df[~duplicated]
+
+    raw_total = df['event_count'].sum()
+
+    aggregated = defaultdict(int)
+    for record in chain_records(df, base_key):
+        event_count = safe_int(record.get('event_count', 0))
+        if event_count == 0:
+            continue
+        aggregated[tuple(record_chain(record, base_key))] += event_count
+
+    tree_total = sum(aggregated.values())
+    return raw_total, tree_total, raw_total - tree_total
+
+
+def cleaned_matches(column, selected_customer):
+    """Boolean array: does each value of ``column`` ``deep_clean`` to ``selected_customer``?
+
+    Each distinct value is cleaned once; missing values never match.
+    """
+    codes, uniques = pd.factorize(column)
+    hits = np.array([deep_clean(value) == selected_customer for value in uniques] + [False], dtype=bool)
+    return hits[codes]
+
+
+def analyze_positions(df, chart_type, selected_customer):
+    """Count records and events per position of ``selected_customer`` in the chains.
+
+    Downstream positions are ``Root``/``Pos-i``, upstream ones ``Base``/``Up-i``,
+    listed in the order a row-by-row scan would first meet them.
+    """
+    base_key, base_pos, hop_prefix = (
+        ('original_customer', 'Root', 'Pos') if chart_type == "downstream" else ('customer', 'Base', 'Up')
+    )
+    if 'event_count' not in df.columns:
+        counts = np.zeros(len(df), dtype=np.int64)
+    elif pd.api.types.is_integer_dtype(df['event_count']):
+        counts = df['event_count'].to_numpy(dtype=np.int64)
+    else:
+        counts = df['event_count'].map(safe_int).to_numpy(dtype=np.int64)
+
+    found = []
+    columns = [(base_key, base_pos)] + [(f'customer_{i}', f'{hop_prefix}-{i}') for i in range(1, MAX_HOPS + 1)]
+    for order, (col, pos) in enumerate(columns):
+        if col not in df.columns:
+            continue
+        mask = cleaned_matches(df[col], selected_customer)
+        rows = np.flatnonzero(mask)
+        if len(rows):
+            found.append((rows[0], order, pos, len(rows), int(counts[mask].sum())))
+
+    found.sort()
+    positions = {pos: records for _, _, pos, records, _ in found}
+    events = {pos: total for _, _, pos, _, total in found}
+    return positions, events
+
+
+# ---------------------- Top-K paths ----------------------
+
+def _ranked(entries, total):
+    return [
+        {
+            "rank": rank,
+            "path": chain,
+            "hops": len(chain) - 1,
+            "events": count,
+            "share": (count / total * 100) if total > 0 else 0,
+        }
+        for rank, (chain, count) in enumerate(entries, 1)
+    ]
+
+
+def top_paths(aggregated, n=10):
+    """Return the ``n`` heaviest chains with their event counts and share of the total.
+
+    Uses a bounded heap, so the cost is O(paths · log n) instead of sorting every path.
+    """
+    total = sum(aggregated.values())
+    best = heapq.nlargest(n, aggregated.items(), key=itemgetter(1))
+    return _ranked(best, total)
+
+
+def top_paths_by_depth(aggregated, n=10):
+    """Return ``{hops: ranked paths}`` keeping the ``n`` heaviest chains per hop depth.
+
+    Shares are relative to the overall total. One pass with a size-``n`` heap per depth.
+    """
+    total = sum(aggregated.values())
+    heaps = defaultdict(list)
+    for seq, (chain, count) in enumerate(aggregated.items()):
+        heap = heaps[len(chain) - 1]
+        # seq breaks ties so chains themselves are never compared
+        entry = (count, -seq, chain)
+        if len(heap) < n:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    by_depth = {}
+    for hops in sorted(heaps):
+        entries = [(chain, count) for count, _, chain in sorted(heaps[hops], reverse=True)]
+        by_depth[hops] = _ranked(entries, total)
+    return by_depth
+
+
+def format_path(chain, max_len=60):
+    """Render a chain as ``A/B/C`` truncated for display"""
+    display_path = "/".join(chain)
+    if len(display_path) > max_len:
+        display_path = display_path[:max_len - 3] + "..."
+    return display_path
+
+
+# ---------------------- Tree building ----------------------
+
+def build_tree(aggregated, root_label="", hop_labels=True):
+    """Turn ``{chain: event_count}`` into icicle arrays with integer node ids.
+
+    Node ``i`` sits at position ``i`` of every array and the root (0) has parent ``None``.
+    Children are looked up by ``(parent, name)`` so no path strings are built.
+    Returns ``labels, parents, values, ids, totals, leaf_values`` where ``totals``
+    is aligned with ``ids`` and ``leaf_values`` maps chain-end nodes to their counts.
+    """
+    labels, parents = [root_label], [None]
+    node_index = {}
+    leaf_values = defaultdict(int)
+
+    for chain, count in aggregated.items():
+        node = 0
+        for i, name in enumerate(chain):
+            child = node_index.get((node, name))
+            if child is None:
+                child = len(labels)
+                node_index[(node, name)] = child
+                labels.append(f"{name} (Hop {i})" if hop_labels and i > 0 else name)
+                parents.append(node)
+            node = child
+        leaf_values[node] += count
+
+    # Children always get larger ids than their parent, so one reverse pass rolls totals up
+    totals = [0] * len(labels)
+    has_children = [False] * len(labels)
+    for node, count in leaf_values.items():
+        totals[node] += count
+    for node in range(len(labels) - 1, 0, -1):
+        totals[parents[node]] += totals[node]
+        has_children[parents[node]] = True
+
+    values = [0 if has_children[node] else leaf_values.get(node, 0) for node in range(len(labels))]
+    return labels, parents, values, list(range(len(labels))), totals, dict(leaf_values)
+
+
+def build_chart(df, selected_customer=ALL_CUSTOMERS, max_hops=MAX_HOPS, min_hops=0,
+                root_label="Customer Chain", hop_labels=True):
+    """Build icicle arrays for the chains in ``df`` rooted at ``selected_customer``.
+
+    Returns ``labels, parents, values, ids, totals, leaf_values`` as described in ``build_tree``.
+    """
+    records = chain_records(filter_customer(df, selected_customer))
+    aggregated = aggregate_paths(records, max_hops=max_hops, min_hops=min_hops)
+    return build_tree(aggregated, root_label=root_label, hop_labels=hop_labels)
+
+
+def build_upstream_chart(df, selected_customer=ALL_CUSTOMERS, hop_filter="All Hops", **options):
+    """Build the upstream icicle, keeping the hops allowed by ``hop_filter``"""
+    return build_chart(df, selected_customer, max_hops=hop_depth(hop_filter), **options)
+
+
+def build_downstream_chart(df, selected_customer=ALL_CUSTOMERS, **options):
+    """Build the downstream icicle"""
+    return build_chart(df, selected_customer, **options)
+
+
+# ---------------------- Tail folding & drill-down ----------------------
+
+def _children_index(parents, ids):
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    children = defaultdict(list)
+    for node_id, parent_id in zip(ids, parents):
+        children[parent_id].append(node_id)
+    return index, children
+
+
+def fold_tail(labels, parents, values, ids, totals, max_children=25, max_per_level=200):
+    """Cap the icicle at ``max_children`` per parent and ``max_per_level`` per depth.
+
+    Children beyond the cap are folded into one ``Other (N partners)`` leaf per parent
+    whose value is the sum of the folded subtree totals, so every kept node keeps its
+    exact total. Returns ``labels, parents, values, ids, totals, folded`` where
+    ``folded`` maps each Other node id to the ids it replaces.
+    """
+    index, children = _children_index(parents, ids)
+    next_id = max(ids, default=-1) + 1
+
+    def total_of(node_id):
+        return totals[index[node_id]]
+
+    out_labels, out_parents, out_values, out_ids, out_totals = [], [], [], [], []
+    folded = {}
+
+    def keep(node_id):
+        i = index[node_id]
+        out_labels.append(labels[i])
+        out_parents.append(parents[i])
+        out_values.append(values[i])
+        out_ids.append(node_id)
+        out_totals.append(totals[i])
+
+    level = [node_id for node_id, parent_id in zip(ids, parents) if parent_id not in index]
+    for node_id in level:
+        keep(node_id)
+
+    while level:
+        candidates = []
+        overflow = {}
+        for parent_id in level:
+            kids = sorted(children.get(parent_id, ()), key=total_of, reverse=True)
+            candidates.extend(kids[:max_children])
+            overflow[parent_id] = kids[max_children:]
+
+        if len(candidates) > max_per_level:
+            candidates.sort(key=total_of, reverse=True)
+            for node_id in candidates[max_per_level:]:
+                overflow[parents[index[node_id]]].append(node_id)
+            candidates = candidates[:max_per_level]
+
+        for node_id in candidates:
+            keep(node_id)
+
+        for parent_id, rest in overflow.items():
+            if not rest:
+                continue
+            other_total = sum(total_of(node_id) for node_id in rest)
+            out_labels.append(f"Other ({len(rest)} partners)")
+            out_parents.append(parent_id)
+            out_values.append(other_total)
+            out_ids.append(next_id)
+            out_totals.append(other_total)
+            folded[next_id] = rest
+            next_id += 1
+
+        level = candidates
+
+    return out_labels, out_parents, out_values, out_ids, out_totals, folded
+
+
+def subtree(labels, parents, values, ids, totals, node_id):
+    """Return the arrays for ``node_id`` and its descendants, with ``node_id`` as the root"""
+    index, children = _children_index(parents, ids)
+    out_labels, out_parents, out_values, out_ids, out_totals = [], [], [], [], []
+
+    stack = [node_id]
+    while stack:
+        current = stack.pop()
+        i = index[current]
+        out_labels.append(labels[i])
+        out_parents.append(None if current == node_id else parents[i])
+        out_values.append(values[i])
+        out_ids.append(current)
+        out_totals.append(totals[i])
+        stack.extend(children.get(current, ()))
+
+    return out_labels, out_parents, out_values, out_ids, out_totals
+
+
+def drill_targets(labels, parents, ids, totals, folded, limit=100):
+    """Return ``{node_id: display label}`` for the heaviest expandable nodes below the root"""
+    index, children = _children_index(parents, ids)
+    expandable = [
+        node_id for node_id, parent_id in zip(ids, parents)
+        if parent_id in index and children.get(node_id) and node_id not in folded
+    ]
+    targets = {}
+    for node_id in heapq.nlargest(limit, expandable, key=lambda n: totals[index[n]]):
+        i = index[node_id]
+        parent_i = index[parents[i]]
+        prefix = f"{labels[parent_i]} › " if labels[parent_i] else ""
+        targets[node_id] = f"{prefix}{labels[i]} ({totals[i]:,} events)"
+    return targets
+
+
+# ---------------------- Comparing two windows ----------------------
+
+def merge_trees(current, baseline):
+    """Align two ``build_*_chart`` trees node by node without re-aggregating any chain.
+
+    A node matches when its label and its parent's match. Both trees list parents
+    before children, so one pass over each maps its ids onto the merged tree.
+    Returns ``labels, parents, current_totals, baseline_totals`` for the union of
+    nodes, node ``i`` at position ``i`` and the root (0) first.
+    """
+    labels, parents = [current[0][0] if current[0] else baseline[0][0]], [None]
+    sides = ([0], [0])
+    merged_ids = {}
+
+    for side, tree in enumerate((current, baseline)):
+        tree_labels, tree_parents, tree_totals = tree[0], tree[1], tree[4]
+        if not tree_labels:
+            continue
+        mapping = [0] * len(tree_labels)
+        sides[side][0] += tree_totals[0]
+        for node in range(1, len(tree_labels)):
+            key = (mapping[tree_parents[node]], tree_labels[node])
+            merged = merged_ids.get(key)
+            if merged is None:
+                merged = merged_ids[key] = len(labels)
+                labels.append(tree_labels[node])
+                parents.append(key[0])
+                sides[0].append(0)
+                sides[1].append(0)
+            mapping[node] = merged
+            sides[side][merged] += tree_totals[node]
+
+    return labels, parents, sides[0], sides[1]
+
+
+def tree_delta(current, baseline, current_months=1, baseline_months=1):
+    """Merge two trees and put both windows on a per-month footing.
+
+    Returns ``labels, parents, values, ids, totals, now, before``: ``now`` and
+    ``before`` are each node's events per month in the two windows, ``totals`` the
+    larger of the two (what the comparison icicle is sized by) and ``values`` that
+    size on leaves only, ready for ``fold_delta`` and ``delta_figure``.
+    """
+    labels, parents, current_totals, baseline_totals = merge_trees(current, baseline)
+    now = [total / current_months for total in current_totals]
+    before = [total / baseline_months for total in baseline_totals]
+    totals = [max(pair) for pair in zip(now, before)]
+
+    has_children = [False] * len(labels)
+    for parent in parents[1:]:
+        has_children[parent] = True
+    values = [0 if has_children[node] else totals[node] for node in range(len(labels))]
+    return labels, parents, values, list(range(len(labels))), totals, now, before
+
+
+def fold_delta(delta, max_children=25, max_per_level=200):
+    """``fold_tail`` for a ``tree_delta``; each Other node adds up the rates it replaces"""
+    labels, parents, values, ids, totals, now, before = delta
+    labels, parents, values, ids, totals, folded = fold_tail(
+        labels, parents, values, ids, totals, max_children, max_per_level
+    )
+    # Kept ids are still positions in the merged tree
+    folded_now = [sum(now[i] for i in folded[n]) if n in folded else now[n] for n in ids]
+    folded_before = [sum(before[i] for i in folded[n]) if n in folded else before[n] for n in ids]
+    return labels, parents, values, ids, totals, folded_now, folded_before
+
+
+def change_status(now, before):
+    if not before:
+        return "new" if now else "same"
+    if not now:
+        return "lost"
+    if now == before:
+        return "same"
+    return "up" if now > before else "down"
+
+
+def top_changes(delta, n=20):
+    """Return the ``n`` partners (below the first level) whose monthly rate changed most"""
+    labels, parents, _, ids, _, now, before = delta
+    changed = [node for node in ids[1:] if parents[node] != 0 and now[node] != before[node]]
+    rows = []
+    for node in heapq.nlargest(n, changed, key=lambda node: abs(now[node] - before[node])):
+        chain = []
+        step = parents[node]
+        while step:
+            chain.append(labels[step])
+            step = parents[step]
+        rows.append({
+            "partner": labels[node],
+            "via": " › ".join(reversed(chain)),
+            "now": now[node],
+            "before": before[node],
+            "change": now[node] - before[node],
+            "status": change_status(now[node], before[node]),
+        })
+    return rows
@@ -0,0 +1,115 @@
+import numpy as np
+import plotly.graph_objects as go
+
+
+HOVER_TEMPLATE = (
+    "<b>%{label}</b><br>" +
+    "Event Count: %{customdata[0]:,}<br>" +
+    "Percent of Total: %{customdata[1]:.2f}%<br>" +
+    "<extra></extra>"
+)
+
+
+def icicle_figure(labels, parents, values, ids, totals, title, color, total_events=None, height=600):
+    """Build a go.Icicle straight from the ``build_*_chart`` arrays.
+
+    ``totals`` is aligned with ``ids``. Node ids are re-encoded as their array position
+    so the figure only carries short ids, and customdata is a numeric ``[total, percent]``
+    array. Percentages are relative to ``total_events`` or, if omitted, to the root totals.
+    """
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    short_ids = np.arange(len(ids)).astype(str)
+    short_parents = [str(index[parent_id]) if parent_id in index else "" for parent_id in parents]
+
+    node_totals = np.asarray(totals, dtype=np.int64)
+    if total_events is None:
+        total_events = sum(total for total, parent_id in zip(totals, parents) if parent_id not in index)
+    if total_events > 0:
+        percentages = node_totals / total_events * 100
+    else:
+        percentages = np.zeros(len(ids))
+
+    fig = go.Figure(go.Icicle(
+        labels=labels,
+        parents=short_parents,
+        values=np.asarray(values, dtype=np.int64),
+        ids=short_ids,
+        customdata=np.column_stack((node_totals, percentages)),
+        hovertemplate=HOVER_TEMPLATE,
+        marker=dict(showscale=False)
+    ))
+    fig.update_layout(title=title, iciclecolorway=[color], height=height)
+    return fig
+
+
+def partner_figure(labels, parents, values, ids, totals, title, color, total_events=None):
+    """``icicle_figure`` with the partner flow page's layout; the batch export draws the same figures"""
+    fig = icicle_figure(labels, parents, values, ids, totals, title, color, total_events=total_events)
+    fig.update_layout(
+        font_size=10,
+        title_font_size=16,
+        title_font_color="#2c3e50",
+        margin=dict(t=50, l=20, r=20, b=20),
+        paper_bgcolor="#ffffff"
+    )
+    return fig
+
+
+def trend_figure(table, title, height=350):
+    """Stacked monthly bars from ``partitions.trend``: one trace per partner column"""
+    fig = go.Figure([
+        go.Bar(x=table.index, y=table[partner], name=str(partner),
+               hovertemplate="%{x}<br>%{y:,} events<extra>%{fullData.name}</extra>")
+        for partner in table.columns
+    ])
+    fig.update_layout(
+        title=title, barmode="stack", height=height, font_size=10, title_font_size=14,
+        margin=dict(t=50, l=20, r=20, b=20), legend=dict(orientation="h", y=-0.2),
+        xaxis=dict(type="category"), paper_bgcolor="#ffffff"
+    )
+    return fig
+
+
+DELTA_HOVER_TEMPLATE = (
+    "<b>%{label}</b><br>" +
+    "Now: %{customdata[0]:,.0f} events/month<br>" +
+    "Before: %{customdata[1]:,.0f} events/month<br>" +
+    "Change: %{customdata[2]:+,.0f} (%{customdata[3]})<br>" +
+    "<extra></extra>"
+)
+DELTA_COLORSCALE = [[0.0, "#C0392B"], [0.5, "#E5E7EB"], [1.0, "#27AE60"]]
+
+
+def delta_figure(labels, parents, values, ids, totals, now, before, title, height=600):
+    """Icicle of a ``chart_engine.tree_delta``: sized by the larger window, red for shrinking, green for growing"""
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    short_parents = [str(index[parent_id]) if parent_id in index else "" for parent_id in parents]
+
+    now = np.asarray(now, dtype=float)
+    before = np.asarray(before, dtype=float)
+    change = now - before
+    # -1 = lost, 1 = new, in between relative to the larger window
+    scale = np.divide(change, np.maximum(now, before), out=np.zeros(len(ids)), where=np.maximum(now, before) > 0)
+    growth = np.divide(change, before, out=np.zeros(len(ids)), where=before > 0) * 100
+    status = [
+        ("new" if now_rate else "–") if not before_rate else "lost" if not now_rate else f"{percent:+.0f}%"
+        for now_rate, before_rate, percent in zip(now, before, growth)
+    ]
+    customdata = np.empty((len(ids), 4), dtype=object)
+    customdata[:, 0], customdata[:, 1], customdata[:, 2], customdata[:, 3] = now, before, change, status
+
+    fig = go.Figure(go.Icicle(
+        labels=labels,
+        parents=short_parents,
+        values=np.asarray(values, dtype=float),
+        ids=np.arange(len(ids)).astype(str),
+        customdata=customdata,
+        hovertemplate=DELTA_HOVER_TEMPLATE,
+        marker=dict(colors=scale, colorscale=DELTA_COLORSCALE, cmin=-1, cmax=1, showscale=True,
+                    colorbar=dict(title="Change", tickvals=[-1, 0, 1], ticktext=["lost", "same", "new"]))
+    ))
+    fig.update_layout(
+        title=title, height=height, font_size=10, title_font_size=16, title_font_color="#2c3e50",
+        margin=dict(t=50, l=20, r=20, b=20), paper_bgcolor="#ffffff"
+    )
+    return fig
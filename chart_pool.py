@@ -0,0 +1,164 @@
+"""Bounded process pool for CPU-heavy chart work.
+
+Tree building is pure Python, so running it on Streamlit's session threads lets
+one "All Customers – 1 Year" rerun stall every other session through the GIL.
+``run(key, fn, args)`` executes ``fn(*args)`` in one of ``CHART_WORKERS`` worker
+processes instead (default: one per spare core, at most 4; ``0``, the default on
+a single core, runs everything inline). ``fn`` must be a module-level function
+and its arguments and result plain picklable data, e.g. a CSV path and options
+in, tree arrays out.
+
+Identical in-flight requests (same ``key``) share one future. While waiting,
+``wait()`` is called every ``poll`` seconds; a page passes a callback that
+touches a Streamlit element, which is where Streamlit interrupts a superseded
+rerun. When the last waiter goes away before a queued request has started, the
+request is cancelled. A request already running finishes in its worker.
+
+Workers are spawned, so each one imports the parent's ``__main__`` script as
+``__mp_main__``. Scripts using the pool keep their top level under
+``if __name__ == "__main__":`` (Streamlit runs pages as ``__main__``), and
+``start()`` launches every worker once, from the prewarm thread rather than
+from a session, so nothing has to touch ``sys.modules`` per request.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+
+logger = logging.getLogger("icicle.pool")
+
+_lock = threading.RLock()
+_executor = None
+_slots = None
+_inflight = {}
+
+
+def workers():
+    default = min(4, (os.cpu_count() or 1) - 1)
+    return int(os.getenv("CHART_WORKERS", str(default)))
+
+
+def enabled():
+    return workers() > 0
+
+
+def _init_worker():
+    # A worker only builds charts: no pool or prewarm thread of its own
+    os.environ["CHART_WORKERS"] = "0"
+    os.environ["PREWARM_ENABLED"] = "False"
+
+
+def _ready():
+    return os.getpid()
+
+
+def executor():
+    """The shared pool with spawned (not forked) workers; created by ``start()`` or on first use"""
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            # Forking a threaded server can copy held locks into the child
+            _executor = ProcessPoolExecutor(
+                max_workers=workers(), mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+            _slots = threading.BoundedSemaphore(workers())
+        return _executor
+
+
+def start():
+    """Create the pool and launch all its workers now instead of on the first requests.
+
+    The executor spawns a worker per submission while none is idle, so one
+    placeholder task per worker, submitted back to back, starts them all.
+    """
+    if not enabled():
+        return 0
+    pool = executor()
+    for future in [pool.submit(_ready) for _ in range(workers())]:
+        future.result()
+    logger.info("chart pool started %d workers", workers())
+    return workers()
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+        _inflight.clear()
+
+
+class _Flight:
+    """One request: queued here until a worker slot frees up, then a pool future"""
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.future = None
+        self.waiters = 0
+
+
+def _dispatch(key, flight, timeout):
+    """Submit ``flight`` once a worker is free; returns False if none freed up within ``timeout``.
+
+    The executor marks anything it has accepted as running, so requests are held
+    back here instead, where a superseded one can still be dropped.
+    """
+    pool = executor()
+    slots = _slots
+    if not slots.acquire(timeout=timeout):
+        return False
+    with _lock:
+        if flight.future is not None:
+            slots.release()
+            return True
+        future = pool.submit(flight.fn, *flight.args)
+        flight.future = future
+    future.add_done_callback(lambda done: (slots.release(), _forget(key, flight)))
+    return True
+
+
+def _forget(key, flight):
+    with _lock:
+        if _inflight.get(key) is flight:
+            del _inflight[key]
+
+
+def run(key, fn, args=(), wait=None, poll=0.1):
+    """Return ``fn(*args)`` computed in the pool, sharing the work with identical in-flight requests"""
+    if not enabled():
+        return fn(*args)
+
+    with _lock:
+        flight = _inflight.get(key)
+        if flight is None:
+            flight = _inflight[key] = _Flight(fn, args)
+        flight.waiters += 1
+
+    try:
+        while True:
+            try:
+                if flight.future is None:
+                    if not _dispatch(key, flight, poll):
+                        if wait is not None:
+                            wait()
+                        continue
+                return flight.future.result(timeout=poll)
+            except FutureTimeout:
+                if wait is not None:
+                    wait()
+            except BrokenProcessPool:
+                logger.warning("chart pool broke; computing %s inline", key)
+                shutdown()
+                return fn(*args)
+    finally:
+        with _lock:
+            flight.waiters -= 1
+            # Superseded and nobody else wants it: drop it if it was never handed to a worker
+            if flight.waiters == 0 and flight.future is None:
+                _forget(key, flight)
@@ -0,0 +1 @@
+# Lets tests/ import the top-level dashboard modules (pytest puts this directory on sys.path)
@@ -1,14 +1,29 @@
 const crypto = require('crypto');
 const tokenStore = require('../utils/tokenStore');
+const tokenMetrics = require('../utils/tokenMetrics');
+
+// Start timing an operation; the returned function records its result
+const track = (operation) => {
+  const stopTimer = tokenMetrics.duration.startTimer({ operation });
+  return (result) => {
+    stopTimer();
+    tokenMetrics.requests.inc({ operation, result });
+  };
+};
 
 exports.generateToken = (req, res) => {
+  const done = track('generate');
   const apiKey = req.headers['x-api-key'];
-  if (apiKey !== process.env.ICICLE_API_KEY)
+  if (apiKey !== process.env.ICICLE_API_KEY) {
+    done('unauthorized');
     return res.status(401).json({ error: 'Invalid API key' });
+  }
 
   const { customer_id } = req.body;
-  if (!customer_id)
+  if (!customer_id) {
+    done('bad_request');
     return res.status(400).json({ error: 'customer_id is required' });
+  }
 
   const token = crypto.randomBytes(32).toString('hex');
   tokenStore.set(token, {
@@ -19,27 +34,37 @@ exports.generateToken = (req, res) => {
 
   const streamlitUrl = `${process.env.STREAMLIT_URL}?token=${token}&customer-id=${customer_id}`;
   res.json({ token, url: streamlitUrl, expires_in: 3600 });
+  done('ok');
 };
 
 exports.validateToken = (req, res) => {
+  const done = track('validate');
   const apiKey = req.headers['x-api-key'];
-  if (apiKey !== process.env.ICICLE_API_KEY)
+  if (apiKey !== process.env.ICICLE_API_KEY) {
+    done('unauthorized');
     return res.status(401).json({ error: 'Invalid API key' });
+  }
 
   const { token } = req.body;
   const tokenData = tokenStore.get(token);
   if (!tokenData || Date.now() > tokenData.expires_at) {
+    if (tokenData) tokenMetrics.expirations.inc({ source: 'validate' });
     tokenStore.delete(token);
+    done(tokenData ? 'expired' : 'invalid');
     return res.status(401).json({ error: 'Invalid or expired token' });
   }
 
   res.json({ valid: true, customer_id: tokenData.customer_id });
+  done('ok');
 };
 
 exports.cleanupTokens = (req, res) => {
+  const done = track('cleanup');
   const apiKey = req.headers['x-api-key'];
-  if (apiKey !== process.env.ICICLE_API_KEY)
+  if (apiKey !== process.env.ICICLE_API_KEY) {
+    done('unauthorized');
     return res.status(401).json({ error: 'Invalid API key' });
+  }
 
   let removed = 0;
   for (const [key, val] of tokenStore.entries()) {
@@ -48,6 +73,8 @@ exports.cleanupTokens = (req, res) => {
       removed++;
     }
   }
+  if (removed) tokenMetrics.expirations.inc({ source: 'cleanup' }, removed);
 
   res.json({ message: 'Cleanup complete', removed, remaining: tokenStore.size });
+  done('ok');
 };
@@ -2,10 +2,13 @@ import os
 import pandas as pd
 import psycopg2
 from dotenv import load_dotenv
-import shutil
-from datetime import datetime
 from sshtunnel import SSHTunnelForwarder
 
+from chart_cache import dataset_paths
+from customer_aliases import write_aliases
+from data_checks import check_csv, summary, write_manifest
+from partitions import derive_windows, latest_complete_month, partition_path, publish_csv
+
 # Load environment variables
 load_dotenv()
 
@@ -46,7 +49,12 @@ def get_db_connection():
 
 
 
-def get_icicle_data(query, period, filename):   
+def get_icicle_data(query, period, filename, keep_empty=False):
+    """Run ``query`` and publish the result to ``filename``.
+
+    An empty result is only written when ``keep_empty`` is set: a monthly
+    partition with no events still has to exist so its month counts as pulled.
+    """
 
     conn, tunnel = get_db_connection()
 
@@ -59,104 +67,88 @@ def get_icicle_data(query, period, filename):
 
     if df_new.empty:
         print("No new or updated records found.")
-        return
-
-    # If existing CSV file exists, update the records instead of appending
-    if os.path.exists(filename):
-        # Destination folder
-        destination_folder = 'archive'
-
-        # Ensure destination folder exists
-        os.makedirs(destination_folder, exist_ok=True)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-
-        # Get filename and extension
-
-        # Create new filename with timestamp
-        new_filename = f"{timestamp}_{os.path.basename(filename)}"
-
-        destination_path = os.path.join(destination_folder, new_filename)
-
-        # Move and rename file
-        shutil.move(filename, destination_path)
+        if not keep_empty:
+            return
 
-        print(f"Moved {filename} to {destination_folder}/")
-        # Save updated file
-        # Ensure parent folder exists
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-
-        # Save main file
-        os.makedirs(os.path.dirname(filename), exist_ok=True)  
-        df_new.to_csv(filename, index=False)
-
-    else:
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        df_new.to_csv(filename, index=False)
+    # The previous version goes to archive/ and the new file is swapped in atomically
+    publish_csv(df_new, filename)
 
     print(f"Updated file saved at: {filename}")
 
 
 
-def build_downstream_query(period):
+def build_downstream_query(period, end=0):
+    """Events from ``period`` months back up to, but excluding, the month ``end`` months back"""
     query = ""    
     with open("queries/downstream.sql", "r") as file:
         query_template = file.read()
 
-    query = query_template.format(period=period)
+    query = query_template.format(period=period, end=end)
     
     return query
 
 
-def build_upstream_query(period):
+def build_upstream_query(period, end=0):
+    """Events from ``period`` months back up to, but excluding, the month ``end`` months back"""
     query = ""    
     with open("queries/upstream.sql", "r") as file:
         query_template = file.read()
     
-    query = query_template.format(period=period)
+    query = query_template.format(period=period, end=end)
     return query
 
 
 
-def main():
-
-################### DOWNSTREAM ################
-    #Build One Month Downstream
-#     query = build_downstream_query(1)
-#     # print(query)
-#     get_icicle_data(query, 1, "D:/icicle_chart/data/shifted_downstream_duration_1month.csv"
-# )
+# Partition kinds (see partitions.KINDS) and the query that pulls one month of each
+MONTHLY_QUERIES = {
+    "shifted_upstream": build_upstream_query,
+    "shifted_downstream": build_downstream_query,
+}
 
 
-    # # Build 3 Months Downstream
-    # query = build_downstream_query(3)
-    # get_icicle_data(query, 1, "D:/icicle_chart/data/shifted_downstream_duration_3month.csv")
+def refresh_partitions(months_back=12):
+    """Pull every missing complete month of the last ``months_back`` into ``monthly/``.
 
-    # # Build Six Months Downstream
-    # query = build_downstream_query(6)
-    # get_icicle_data(query, 1, "D:/icicle_chart/data/shifted_downstream_duration_6month.csv")
+    Past months don't change, so only missing ones are queried, plus the newest
+    complete month, which is always pulled again to pick up late updates. A month
+    without events is written as a header-only partition, so it is not queried
+    again and the windows covering it are still derived.
+    """
+    newest = latest_complete_month()
+    for kind, build_query in MONTHLY_QUERIES.items():
+        for back in range(1, months_back + 1):
+            path = partition_path(kind, newest - (back - 1))
+            if back > 1 and os.path.exists(path):
+                continue
+            get_icicle_data(build_query(back, back - 1), back, path, keep_empty=True)
 
-    # # Build One Year Downstream
-    # query = build_downstream_query(12)
-    # get_icicle_data(query, 1, "D:/icicle_chart/data/shifted_downstream_duration_1year.csv")
 
+def validate_snapshot():
+    """Check every published chain CSV and record the verdicts in the snapshot manifest.
 
-################### UPSTREAM ################
-    # # Build One Month Upstream
-    # query = build_upstream_query(1)
-    # get_icicle_data(query, 1, "D:/icicle_chart/data/shifted_upstream_duration_1month.csv")
+    The dashboard's debug view shows these instead of re-reading the CSVs.
+    """
+    reports = []
+    for path in dataset_paths():
+        if not os.path.exists(path):
+            continue
+        report = check_csv(path)
+        reports.append(report)
+        print(summary(report))
+    print(f"Validation results saved at: {write_manifest(reports)}")
 
-    # # Build 3 Months Upstream
-    query = build_upstream_query(3)
-    get_icicle_data(query, 1, "D:/icicle_chart/data/shifted_upstream_duration_3month.csv")
-
-    # # Build Six Months Upstream
-    # query = build_upstream_query(6)
-    # get_icicle_data(query, 1, "D:/icicle_chart/data/shifted_upstream_duration_6month.csv")
-
-    # # Build One Year Upstream
-    # query = build_upstream_query(12)
-    # get_icicle_data(query, 1, "D:/icicle_chart/data/shifted_upstream_duration_1year.csv")
 
+def main():
+    # One query per month instead of four overlapping windows; the 1/3/6/12-month
+    # files are rolled up from the partitions
+    refresh_partitions()
+    # Pinned to the newest complete month, so a month that failed to pull is an error, not a shift
+    for path in derive_windows(MONTHLY_QUERIES, end=latest_complete_month()):
+        print(f"Derived {path}")
+    # Canonical names and ids for URL, token and API lookups
+    alias_path, customers = write_aliases(dataset_paths())
+    print(f"Alias table saved at: {alias_path} ({customers} customers)")
+    validate_snapshot()
 
 
 if __name__ == "__main__":
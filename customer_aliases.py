@@ -0,0 +1,186 @@
+"""Canonical customer names and ids, written once per snapshot by ``cron_icicle.py``.
+
+Every chart keys customers by ``deep_clean(customer)`` (``customer_cleaned``). The
+alias table maps everything a link or API call may carry onto that key:
+
+    {"customers": {cleaned: {"name": display name, "id": customer_id}},
+     "ids":       {customer_id: cleaned},
+     "loose":     {loose key: cleaned},
+     "names":     [cleaned, ...],              # sorted; positions used by "trigrams"
+     "trigrams":  {trigram: [position, ...]},
+     "sizes":     [trigram count of each name]}
+
+``loose_key`` also drops punctuation and spacing, so "kal-tire  ltd." finds
+"kal tire ltd" unless two customers share the loose form. The display name and id
+of a customer are the ones most of its rows carry across all published windows.
+
+``cron_icicle.py`` writes ``ALIAS_TABLE`` after publishing; without one the table is
+built in-process from the discovery files, so lookups are dictionary hits either way.
+
+``search(query)`` ranks customers for typos and type-ahead from the trigram index:
+only names sharing a trigram with the query are scored, instead of comparing the
+query against every name as ``difflib.get_close_matches`` does.
+"""
+import heapq
+import json
+import os
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import pandas as pd
+
+from chart_cache import LRUCache, file_signature, load_frame
+from chart_data import chain_csv_path, load_chain_csv
+from chart_engine import deep_clean
+
+
+ALIAS_TABLE = os.getenv("ALIAS_TABLE", "customer_aliases.json")
+_LOOSE = re.compile(r'[^a-z0-9]+')
+
+ALIASES = LRUCache("customer_aliases", 2)
+
+
+def loose_key(name):
+    return _LOOSE.sub('', deep_clean(str(name)))
+
+
+def trigrams(text):
+    """The set of 3-character slices of ``text``, padded so word starts weigh more"""
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def discovery_paths():
+    """The files the pages discover customers from when there is no alias table"""
+    return [chain_csv_path("downstream", "1 Month"), chain_csv_path("upstream", "1 Month")]
+
+
+# ---------------------- Building ----------------------
+
+def build_aliases(frames):
+    """Return the alias table for the base customers of the lean ``frames``"""
+    rows = pd.concat([
+        df[['customer_cleaned', 'original_customer', 'customer_id', 'event_count']].astype(
+            {'customer_cleaned': object, 'original_customer': object}
+        )
+        for df in frames
+    ], ignore_index=True)
+    rows = rows[rows['customer_cleaned'] != '']
+    rows['original_customer'] = rows['original_customer'].astype(str).str.strip()
+
+    def most_common(column):
+        counts = rows.groupby(['customer_cleaned', column], dropna=True).size().reset_index(name='rows')
+        counts = counts.sort_values(['customer_cleaned', 'rows', column], ascending=[True, False, True])
+        return counts.drop_duplicates('customer_cleaned').set_index('customer_cleaned')[column]
+
+    names, ids = most_common('original_customer'), most_common('customer_id')
+    customers = {
+        cleaned: {"name": names[cleaned], "id": int(ids[cleaned]) if cleaned in ids.index else None}
+        for cleaned in sorted(names.index)
+    }
+
+    loose = {}
+    for cleaned in customers:
+        key = loose_key(cleaned)
+        # None marks a loose form shared by several customers
+        loose[key] = cleaned if loose.get(key, cleaned) == cleaned else None
+
+    names = list(customers)
+    index = defaultdict(list)
+    for position, cleaned in enumerate(names):
+        for gram in trigrams(cleaned):
+            index[gram].append(position)
+    return {
+        "customers": customers,
+        "ids": {str(entry["id"]): cleaned for cleaned, entry in customers.items() if entry["id"] is not None},
+        "loose": {key: cleaned for key, cleaned in loose.items() if key and cleaned is not None},
+        "names": names,
+        "trigrams": dict(index),
+        "sizes": [len(trigrams(cleaned)) for cleaned in names],
+    }
+
+
+def write_aliases(paths, path=None):
+    """Canonicalize the base customers of every chain CSV in ``paths`` into the alias table"""
+    path = path or ALIAS_TABLE
+    table = build_aliases([load_chain_csv(source) for source in paths if os.path.exists(source)])
+    table["created_at"] = datetime.now().isoformat(timespec="seconds")
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as file:
+        json.dump(table, file, separators=(",", ":"))
+    os.replace(tmp, path)
+    return path, len(table["customers"])
+
+
+# ---------------------- Lookups ----------------------
+
+def load_aliases():
+    """The alias table from ``ALIAS_TABLE``, or built from the discovery files without one"""
+    try:
+        key = file_signature(ALIAS_TABLE)
+    except FileNotFoundError:
+        paths = discovery_paths()
+        return ALIASES.fetch(
+            tuple(file_signature(path) for path in paths),
+            lambda: build_aliases([load_frame(path) for path in paths])
+        )
+
+    def read():
+        with open(ALIAS_TABLE) as file:
+            return json.load(file)
+
+    return ALIASES.fetch(key, read)
+
+
+def resolve_name(name, aliases=None):
+    """Return the cleaned customer ``name`` refers to, or None"""
+    aliases = aliases or load_aliases()
+    cleaned = deep_clean(str(name))
+    if cleaned in aliases["customers"]:
+        return cleaned
+    return aliases["loose"].get(loose_key(cleaned))
+
+
+def resolve_id(customer_id, aliases=None):
+    """Return the cleaned customer with ``customer_id``, or None"""
+    aliases = aliases or load_aliases()
+    return aliases["ids"].get(str(customer_id))
+
+
+def describe(cleaned, aliases=None):
+    """``(display name, customer_id)`` of a cleaned customer name"""
+    entry = (aliases or load_aliases())["customers"].get(cleaned)
+    return (entry["name"], entry["id"]) if entry else (cleaned, None)
+
+
+def search(query, n=10, cutoff=0.3, aliases=None):
+    """Return up to ``n`` cleaned customer names matching ``query``, best first.
+
+    Names are scored by trigram overlap (Dice coefficient). Names starting with the
+    query, then names with a word starting with it, rank above the rest, so the
+    list also works as a type-ahead. Below ``cutoff`` a name is not suggested.
+    """
+    aliases = aliases or load_aliases()
+    query = deep_clean(str(query))
+    if not query:
+        return []
+    names, index, sizes = aliases["names"], aliases["trigrams"], aliases["sizes"]
+    grams = trigrams(query)
+
+    shared = Counter()
+    for gram in grams:
+        shared.update(index.get(gram, ()))
+
+    scored = []
+    for position, common in shared.items():
+        name = names[position]
+        score = 2 * common / (len(grams) + sizes[position])
+        if name.startswith(query):
+            score += 2
+        elif f" {query}" in f" {name}":
+            score += 1
+        if score >= cutoff:
+            scored.append((score, name))
+    return [name for _, name in heapq.nlargest(n, scored, key=lambda item: (item[0], -len(item[1])))]
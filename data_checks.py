@@ -0,0 +1,183 @@
+"""Integrity checks over the published chain CSVs, run by ``cron_icicle.py`` after extraction.
+
+``check_csv(path)`` reads one file in full and counts, per base customer:
+
+* totals conservation - raw ``event_count`` against the totals of the icicle actually built
+* duplicates - repeated ``event_id``s; files without one are left alone, since the
+  shifted files are built with UNION ALL and legitimately repeat identical chain rows
+* chain gaps - an empty ``customer_i`` followed by a non-empty hop, which the charts close up
+* self-forwards - a hop naming the same (cleaned) customer as the node before it
+
+plus, for the whole file, ids that appear with more than one cleaned name or names
+with more than one id. ``write_manifest`` stores the reports in ``SNAPSHOT_MANIFEST``
+together with each file's mtime and size, and ``verdict(path, customer)`` looks one
+up, so the dashboard shows the result without touching the CSV. A file rewritten
+since the last check has no verdict.
+"""
+import json
+import os
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from chart_cache import LRUCache, file_signature
+from chart_data import NAME_COLUMNS, lean_frame
+from chart_engine import ALL_CUSTOMERS, build_chart, clean_key, deep_clean
+
+
+SNAPSHOT_MANIFEST = os.getenv("SNAPSHOT_MANIFEST", "snapshot_manifest.json")
+ISSUES = ("duplicates", "gaps", "self_forwards")
+MAX_EXAMPLES = 5
+
+MANIFESTS = LRUCache("snapshot_manifests", 2)
+
+
+# ---------------------- Checks ----------------------
+
+def _cleaned(frame):
+    """``deep_clean`` every cell of ``frame``, cleaning each distinct string once"""
+    values = frame.to_numpy().ravel()
+    uniques, codes = np.unique(values, return_inverse=True)
+    cleaned = np.array([deep_clean(value) for value in uniques], dtype=object)
+    return cleaned[codes].reshape(frame.shape)
+
+
+def id_name_conflicts(raw, cleaned, names):
+    """Return examples of ids carrying several cleaned names and names carrying several ids"""
+    pairs = pd.concat([
+        pd.DataFrame({"id": raw[f"{col}_id"].str.strip(), "name": cleaned[:, i]})
+        for i, col in enumerate(names) if f"{col}_id" in raw.columns
+    ] or [pd.DataFrame(columns=["id", "name"])], ignore_index=True)
+    pairs = pairs[(pairs["id"] != "") & (pairs["name"] != "")].drop_duplicates()
+
+    conflicts = []
+    for key, other in (("id", "name"), ("name", "id")):
+        spread = pairs.groupby(key)[other].nunique()
+        for value in spread[spread > 1].index:
+            conflicts.append({key: value, f"{other}s": sorted(pairs.loc[pairs[key] == value, other])})
+    return conflicts
+
+
+def check_csv(path):
+    """Return the validation report of one chain CSV, ready for the manifest"""
+    # Missing cells become "" exactly as in ``load_chain_csv``; everything else stays text
+    raw = pd.read_csv(path, dtype=str).fillna("")
+    raw.columns = [clean_key(col) for col in raw.columns]
+    names = [col for col in NAME_COLUMNS if col in raw.columns]
+    cleaned = _cleaned(raw[names])
+    present = cleaned != ""
+    base = cleaned[:, 0]
+
+    if "event_id" in raw.columns:
+        duplicates = raw.duplicated(subset=["event_id"]).to_numpy()
+    else:
+        duplicates = np.zeros(len(raw), dtype=bool)
+    # A node is present while a later one is too, so any empty slot before it is a gap
+    later = np.logical_or.accumulate(present[:, ::-1], axis=1)[:, ::-1]
+    gaps = (~present[:, :-1] & later[:, 1:]).any(axis=1)
+    self_forwards = ((cleaned[:, 1:] == cleaned[:, :-1]) & present[:, 1:]).any(axis=1)
+
+    df = lean_frame(raw[[col for col in raw.columns if col in names or col in ("event_count", "customer_id")]])
+    rows = pd.DataFrame({
+        "customer": base,
+        "raw": df["event_count"].to_numpy(dtype=np.int64),
+        "duplicates": duplicates, "gaps": gaps, "self_forwards": self_forwards,
+    }).groupby("customer").sum()
+
+    # The totals every per-customer chart starts from: the first level of the full tree
+    labels, parents, _, _, totals, _ = build_chart(df, ALL_CUSTOMERS)
+    tree = defaultdict(int)
+    for label, parent, total in zip(labels, parents, totals):
+        if parent == 0:
+            tree[deep_clean(label)] += total
+
+    customers = {}
+    for customer, row in rows.iterrows():
+        customers[customer] = {"raw": int(row["raw"]), "tree": tree.get(customer, 0),
+                               **{issue: int(row[issue]) for issue in ISSUES}}
+
+    conflicts = id_name_conflicts(raw, cleaned, names)
+    return {
+        "path": path,
+        "signature": list(file_signature(path)[1:]),
+        "checked_at": datetime.now().isoformat(timespec="seconds"),
+        "rows": len(raw),
+        "raw": int(rows["raw"].sum()),
+        "tree": int(sum(tree.values())),
+        **{issue: int(rows[issue].sum()) for issue in ISSUES},
+        "id_name_mismatches": len(conflicts),
+        "mismatch_examples": conflicts[:MAX_EXAMPLES],
+        "customers": customers,
+    }
+
+
+def passed(report):
+    return report["raw"] == report["tree"] and not any(report.get(issue) for issue in ISSUES)
+
+
+def summary(report):
+    """One line per file for the cron log"""
+    issues = [f"{report[issue]:,} {issue.replace('_', ' ')}" for issue in ISSUES if report[issue]]
+    if report["raw"] != report["tree"]:
+        issues.insert(0, f"raw {report['raw']:,} != tree {report['tree']:,}")
+    if report["id_name_mismatches"]:
+        issues.append(f"{report['id_name_mismatches']:,} id/name mismatches")
+    return f"{'✅' if not issues else '⚠️'} {report['path']}: {', '.join(issues) or 'ok'}"
+
+
+# ---------------------- Manifest ----------------------
+
+def write_manifest(reports, path=None):
+    """Merge ``reports`` into the snapshot manifest, replacing each file's previous entry"""
+    path = path or SNAPSHOT_MANIFEST
+    manifest = {"files": {}}
+    if os.path.exists(path):
+        with open(path) as file:
+            manifest = json.load(file)
+    manifest["files"].update({report["path"]: report for report in reports})
+    manifest["checked_at"] = datetime.now().isoformat(timespec="seconds")
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as file:
+        json.dump(manifest, file, separators=(",", ":"))
+    os.replace(tmp, path)
+    return path
+
+
+def load_manifest(path=None):
+    """The parsed manifest, re-read only when the file changes; empty without one"""
+    path = path or SNAPSHOT_MANIFEST
+    try:
+        key = file_signature(path)
+    except FileNotFoundError:
+        return {"files": {}}
+
+    def read():
+        with open(path) as file:
+            return json.load(file)
+
+    return MANIFESTS.fetch(key, read)
+
+
+def verdict(path, selected_customer=ALL_CUSTOMERS):
+    """The precomputed checks of ``path`` for one customer (or the whole file).
+
+    Returns None when ``path`` was never checked or has been rewritten since.
+    """
+    report = load_manifest()["files"].get(path)
+    try:
+        if report is None or report["signature"] != list(file_signature(path)[1:]):
+            return None
+    except FileNotFoundError:
+        return None
+
+    result = {key: report[key] for key in ("checked_at", "raw", "tree", *ISSUES)}
+    if selected_customer != ALL_CUSTOMERS:
+        empty = {"raw": 0, "tree": 0, **{issue: 0 for issue in ISSUES}}
+        result.update(report["customers"].get(deep_clean(selected_customer), empty))
+    result["id_name_mismatches"] = report["id_name_mismatches"]
+    result["mismatch_examples"] = report["mismatch_examples"]
+    result["passed"] = passed(result)
+    return result
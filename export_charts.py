@@ -0,0 +1,210 @@
+"""Export every customer's partner icicles to static files for the monthly report.
+
+Run after ``cron_icicle.py`` has published new CSVs:
+
+    python export_charts.py                             # every customer, every duration
+    python export_charts.py --durations "1 Month" --top 50 --workers 8
+    python export_charts.py --images                    # also PNGs (needs kaleido)
+
+For each duration and customer (plus "All Customers") it writes, under
+``exports/<date>/<duration>/``:
+
+    <customer>_<id>.html    # upstream and downstream icicles side by side
+    <customer>_<id>.json    # the tree arrays behind them
+    <customer>_<id>_<direction>.png   # with --images
+
+plus an ``index.html`` and ``manifest.json`` (files, node counts, failures) at the top.
+Customers are exported in parallel worker processes, one per core by default.
+"""
+import argparse
+import html
+import importlib.util
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from plotly.offline import get_plotlyjs
+
+from chart_cache import PARTNER_CHART_OPTIONS, build_from_file, load_frame, top_customers
+from chart_data import DURATIONS, chain_csv_path, customer_directory
+from chart_engine import ALL_CUSTOMERS, fold_tail
+from chart_figures import partner_figure
+
+
+EXPORT_DIR = "exports"
+COLORS = {
+    "upstream": os.getenv("UPSTREAM_COLOR", "#D96F32"),
+    "downstream": os.getenv("DOWNSTREAM_COLOR", "#4C78A8"),
+}
+TITLES = {"upstream": "📈 Upstream Partners", "downstream": "📊 Downstream Partners"}
+PLOTLY_CONFIG = {"scrollZoom": True, "displaylogo": False}
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<script src="plotly.min.js"></script>
+<style>body {{ font-family: sans-serif; }} .charts {{ display: flex; gap: 1rem; }} .charts > div {{ flex: 1; min-width: 0; }}</style>
+</head><body>
+<h2>{title}</h2>
+<div class="charts">{charts}</div>
+</body></html>
+"""
+
+
+def file_slug(name, customer_id):
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', str(name)).strip('-').lower()[:60] or "customer"
+    return f"{slug}_{customer_id}" if customer_id is not None else slug
+
+
+# ---------------------- Jobs ----------------------
+
+def export_jobs(durations, top_n=None, only=None):
+    """List ``(duration, cleaned name, display name, customer_id)``, "All Customers" first per duration"""
+    jobs = []
+    for duration in durations:
+        frames = [load_frame(chain_csv_path(direction, duration, None)) for direction in PARTNER_CHART_OPTIONS]
+        directory = customer_directory(*frames)
+        customers = list(directory)
+        if top_n:
+            busiest = set(top_customers(frames[0], top_n)) | set(top_customers(frames[1], top_n))
+            customers = [name for name in customers if name in busiest]
+        if only:
+            customers = [name for name in customers if only.lower() in name]
+        jobs.append((duration, ALL_CUSTOMERS, ALL_CUSTOMERS, None))
+        jobs += [(duration, name, *directory[name]) for name in customers]
+    return jobs
+
+
+def _init_worker():
+    # Each export worker builds inline; a chart pool per worker would only compete for the same cores
+    os.environ["CHART_WORKERS"] = "0"
+
+
+def export_customer(out_dir, duration, customer, display_name, customer_id, images=False):
+    """Write one customer's HTML, JSON and optional images; returns their manifest entry"""
+    max_children = int(os.getenv("ICICLE_MAX_CHILDREN", "25"))
+    max_per_level = int(os.getenv("ICICLE_MAX_NODES_PER_LEVEL", "200"))
+    base = os.path.join(out_dir, file_slug(display_name, customer_id))
+    trees, charts, nodes = {}, [], {}
+
+    for direction, options in PARTNER_CHART_OPTIONS.items():
+        path = chain_csv_path(direction, duration, customer)
+        labels, parents, values, ids, totals, _ = build_from_file(path, direction, customer, "All Hops", options)
+        trees[direction] = {"labels": labels, "parents": parents, "values": values, "ids": ids, "totals": totals}
+        nodes[direction] = len(ids)
+        if len(ids) <= 1:
+            charts.append(f"<div><p>No {direction} partners.</p></div>")
+            continue
+
+        fig = partner_figure(
+            *fold_tail(labels, parents, values, ids, totals, max_children, max_per_level)[:5],
+            title=f"{TITLES[direction]} – {display_name} – {duration}",
+            color=COLORS[direction]
+        )
+        charts.append(fig.to_html(full_html=False, include_plotlyjs=False, config=PLOTLY_CONFIG))
+        if images:
+            fig.write_image(f"{base}_{direction}.png", width=1200, height=600)
+
+    title = f"{display_name} – {duration}"
+    with open(base + ".html", "w", encoding="utf-8") as file:
+        file.write(PAGE_TEMPLATE.format(title=html.escape(title), charts="\n".join(charts)))
+    with open(base + ".json", "w") as file:
+        json.dump({
+            "customer": customer, "display_name": display_name, "customer_id": customer_id,
+            "duration": duration, **trees
+        }, file, separators=(",", ":"))
+
+    return {
+        "duration": duration, "customer": customer, "display_name": display_name,
+        "customer_id": customer_id, "file": os.path.relpath(base, os.path.dirname(out_dir)), "nodes": nodes,
+    }
+
+
+# ---------------------- Batch ----------------------
+
+def export_all(jobs, out_root, workers, images=False):
+    """Run ``jobs`` across ``workers`` processes, printing progress; returns ``(exported, failed)``"""
+    out_dirs = {}
+    for duration in {job[0] for job in jobs}:
+        out_dirs[duration] = os.path.join(out_root, file_slug(duration, None))
+        os.makedirs(out_dirs[duration], exist_ok=True)
+        with open(os.path.join(out_dirs[duration], "plotly.min.js"), "w", encoding="utf-8") as file:
+            file.write(get_plotlyjs())
+
+    exported, failed = [], []
+    started = time.perf_counter()
+    next_report = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {
+            pool.submit(export_customer, out_dirs[job[0]], *job, images=images): job
+            for job in jobs
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            duration, customer = futures[future][:2]
+            try:
+                exported.append(future.result())
+            except Exception as e:
+                failed.append({"duration": duration, "customer": customer, "error": repr(e)})
+                print(f"  ❌ {duration} / {customer}: {e!r}")
+
+            percent = done * 100 // len(jobs)
+            if percent >= next_report or done == len(jobs):
+                elapsed = time.perf_counter() - started
+                remaining = elapsed / done * (len(jobs) - done)
+                print(f"[{done}/{len(jobs)}] {percent:3d}%  {elapsed:6.1f}s elapsed, ~{remaining:.0f}s left, "
+                      f"{len(failed)} failed", flush=True)
+                next_report = percent + 5
+    return exported, failed
+
+
+def write_index(out_root, exported, failed):
+    exported = sorted(exported, key=lambda entry: (DURATIONS.index(entry["duration"]), entry["customer"]))
+    with open(os.path.join(out_root, "manifest.json"), "w") as file:
+        json.dump({"created_at": datetime.now().isoformat(), "exported": exported, "failed": failed}, file, indent=2)
+
+    rows = []
+    for duration in DURATIONS:
+        entries = [entry for entry in exported if entry["duration"] == duration]
+        if not entries:
+            continue
+        rows.append(f"<h3>{html.escape(duration)}</h3><ul>")
+        rows += [
+            f'<li><a href="{html.escape(entry["file"])}.html">{html.escape(entry["display_name"])}</a></li>'
+            for entry in entries
+        ]
+        rows.append("</ul>")
+    with open(os.path.join(out_root, "index.html"), "w", encoding="utf-8") as file:
+        file.write(f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Partner icicles</title></head>"
+                   f"<body><h2>Partner icicles</h2>{''.join(rows)}</body></html>\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export partner icicles for every customer to static files")
+    parser.add_argument("--out", help=f"output directory (default: {EXPORT_DIR}/<today>)")
+    parser.add_argument("--durations", nargs="*", default=DURATIONS, choices=DURATIONS)
+    parser.add_argument("--top", type=int, help="only the N busiest customers per duration and direction")
+    parser.add_argument("--only", help="only customers whose cleaned name contains this text")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="export processes (default: one per core)")
+    parser.add_argument("--images", action="store_true", help="also write PNGs of every icicle (needs kaleido)")
+    args = parser.parse_args()
+
+    if args.images and importlib.util.find_spec("kaleido") is None:
+        parser.error("--images needs the kaleido package to render figures locally")
+
+    out_root = args.out or os.path.join(EXPORT_DIR, datetime.now().strftime('%Y%m%d'))
+    jobs = export_jobs(args.durations, args.top, args.only)
+    print(f"Exporting {len(jobs)} customer/duration pairs to {out_root} with {args.workers} workers")
+
+    started = time.perf_counter()
+    exported, failed = export_all(jobs, out_root, args.workers, images=args.images)
+    write_index(out_root, exported, failed)
+    print(f"\nExported {len(exported)} in {time.perf_counter() - started:.1f}s, {len(failed)} failed; "
+          f"see {os.path.join(out_root, 'index.html')}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,21 @@
 import streamlit as st
 from upstream_icicle_chart import render_upstream_chart_page
 from hop_level_customers import render_hop_level_page
+from chart_cache import start_prewarmer
 
-st.set_page_config(page_title="Reach Partner View (Beta)", layout="wide")
-st.title("Reach Partner View (Beta)")
 
-tab1, tab2 = st.tabs(["🔁 Partner Flow", "📊 Hop-Level Analysis"])
+# Streamlit runs this script as __main__; chart pool workers import it as __mp_main__ and must skip the page
+if __name__ == "__main__":
+    # Builds "All Customers" and the busiest customers in the background whenever the data changes
+    start_prewarmer()
 
-with tab1:
-    render_upstream_chart_page()
+    st.set_page_config(page_title="Reach Partner View (Beta)", layout="wide")
+    st.title("Reach Partner View (Beta)")
 
-with tab2:
-    render_hop_level_page()
+    tab1, tab2 = st.tabs(["🔁 Partner Flow", "📊 Hop-Level Analysis"])
+
+    with tab1:
+        render_upstream_chart_page()
+
+    with tab2:
+        render_hop_level_page()
@@ -0,0 +1,116 @@
+"""Process-wide Prometheus-style metrics for the dashboard.
+
+Streamlit can't serve an extra scrape route, so ``write_textfile`` renders the
+registry in the text exposition format and atomically replaces ``METRICS_FILE``
+(point node_exporter's textfile collector at its directory). ``PhaseTimer.emit``
+calls it after every rerun.
+"""
+import os
+import threading
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}
+        _registry.append(self)
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            counts, total, count = self.series.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            self.series[key] = (counts, total + seconds, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.series.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+# ---------------------- Dashboard Metrics ----------------------
+
+PHASE_SECONDS = Histogram(
+    "icicle_phase_duration_seconds",
+    "Time spent in each page phase (csv_load, clean, tree_build, figure_build, ...)."
+)
+RERUN_SECONDS = Histogram("icicle_rerun_duration_seconds", "Total time of a page rerun.")
+CACHE_LOOKUPS = Counter("icicle_cache_lookups_total", "Lookups against a Streamlit data cache.")
+CACHE_MISSES = Counter("icicle_cache_misses_total", "Cache lookups that had to compute the value.")
+CACHE_COALESCED = Counter(
+    "icicle_cache_coalesced_total", "Cache misses that waited on an identical in-flight computation."
+)
+API_SECONDS = Histogram("icicle_api_request_duration_seconds", "Chart API requests, by route and status.")
+TOKEN_SECONDS = Histogram(
+    "icicle_token_validation_duration_seconds",
+    "Round trip to the token service's validate endpoint, by result."
+)
+
+
+def observe_rerun(record):
+    """Fold a ``PhaseTimer.record()`` into the phase and rerun histograms"""
+    page = record["page"]
+    RERUN_SECONDS.observe(record["total_ms"] / 1000, page=page)
+    for span in record["spans"]:
+        PHASE_SECONDS.observe(span["ms"] / 1000, page=page, phase=span["phase"])
+
+
+def render():
+    with _lock:
+        return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+def write_textfile(path=None):
+    """Write the registry to ``path`` (default ``METRICS_FILE``); a no-op when neither is set"""
+    path = path or os.getenv("METRICS_FILE")
+    if not path:
+        return None
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as file:
+        file.write(render())
+    os.replace(tmp, path)
+    return path
@@ -0,0 +1,248 @@
+"""Monthly partitions of the chain CSVs and the windows derived from them.
+
+``cron_icicle.py`` pulls every complete calendar month once into
+
+    monthly/<kind>_<YYYY-MM>.csv     # same columns as the published chain CSVs
+
+where ``kind`` is one of ``KINDS`` (``PARTITION_DIR`` overrides ``monthly``). An event
+belongs to exactly one month, so a window's ``COUNT(DISTINCT event_id)`` per chain is
+the sum of its months' counts. ``derive_windows`` therefore publishes the 1/3/6/12-month
+files from the partitions instead of four separate pulls, ``range_csv_path`` serves
+any other month range the same way, and ``trend`` gives a customer's partner volume
+month over month.
+"""
+import glob
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from chart_cache import LRUCache, SingleFlight, file_signature, load_frame
+from chart_data import DURATION_MONTHS, chain_csv_path
+from chart_engine import ALL_CUSTOMERS, filter_customer
+
+
+logger = logging.getLogger("icicle.partitions")
+
+PARTITION_DIR = os.getenv("PARTITION_DIR", "monthly")
+
+# kind -> (direction, customer argument of chain_csv_path for its published windows)
+KINDS = {
+    "upstream": ("upstream", ALL_CUSTOMERS),
+    "downstream": ("downstream", ALL_CUSTOMERS),
+    "shifted_upstream": ("upstream", None),
+    "shifted_downstream": ("downstream", None),
+}
+CUSTOM_RANGE = "Custom range"
+
+MATRICES = LRUCache("partition_matrices", 8)
+RANGE_FILES = SingleFlight("range_files")
+
+
+def kind_of(direction, selected_customer):
+    """The partition kind behind a chart, mirroring ``chain_csv_path``"""
+    return direction if selected_customer == ALL_CUSTOMERS else f"shifted_{direction}"
+
+
+def latest_complete_month(today=None):
+    return pd.Period(today or datetime.now(), "M") - 1
+
+
+def partition_path(kind, month):
+    return os.path.join(PARTITION_DIR, f"{kind}_{pd.Period(month, 'M')}.csv")
+
+
+def available_months(kind):
+    """Sorted ``pd.Period`` months that have a partition for ``kind``"""
+    paths = glob.glob(os.path.join(PARTITION_DIR, f"{kind}_*.csv"))
+    return sorted(pd.Period(os.path.basename(path)[len(kind) + 1:-len(".csv")], "M") for path in paths)
+
+
+def publish_csv(df, filename, archive_dir="archive"):
+    """Write ``df`` to ``filename``, copying any previous version to ``archive_dir`` first.
+
+    The new file is written next to the old one and swapped in, so readers never
+    see a missing or half-written file.
+    """
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    if os.path.exists(filename):
+        os.makedirs(archive_dir, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        shutil.copy2(filename, os.path.join(archive_dir, f"{timestamp}_{os.path.basename(filename)}"))
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, filename)
+    return filename
+
+
+# ---------------------- Month Ranges ----------------------
+
+def _build_matrix(kind, months):
+    frames = []
+    for position, month in enumerate(months):
+        df = pd.read_csv(partition_path(kind, month), dtype=object)
+        df['event_count'] = pd.to_numeric(df['event_count'], errors='coerce').fillna(0).astype('int64')
+        df['position'] = position
+        frames.append(df)
+    columns = list(frames[0].columns.drop('position'))
+    chain_columns = [col for col in columns if col != 'event_count']
+
+    combined = pd.concat(frames, ignore_index=True)
+    combined[chain_columns] = combined[chain_columns].fillna('')
+    by_month = combined.pivot_table(
+        index=chain_columns, columns='position', values='event_count', aggfunc='sum', fill_value=0
+    ).reindex(columns=range(len(months)), fill_value=0)
+
+    cumulative = np.zeros((len(by_month), len(months) + 1), dtype=np.int64)
+    np.cumsum(by_month.to_numpy(), axis=1, out=cumulative[:, 1:])
+    return by_month.index.to_frame(index=False), cumulative, columns
+
+
+def month_matrix(kind):
+    """``(months, chains, cumulative, columns)`` over every partition of ``kind``.
+
+    ``chains`` holds one row of chain columns per distinct chain and ``cumulative``
+    is a chains x (months + 1) array whose column ``j`` sums the first ``j`` months,
+    so any contiguous range is a difference of two columns. Rebuilt when a
+    partition is added or rewritten.
+    """
+    months = available_months(kind)
+    if not months:
+        raise FileNotFoundError(f"no {kind} partitions in {PARTITION_DIR}")
+    key = (kind, tuple(file_signature(partition_path(kind, month)) for month in months))
+    return (months, *MATRICES.fetch(key, lambda: _build_matrix(kind, months)))
+
+
+def range_frame(kind, start, end):
+    """Chain counts summed over the months ``start`` to ``end`` inclusive, heaviest first"""
+    months, chains, cumulative, columns = month_matrix(kind)
+    start, end = pd.Period(start, "M"), pd.Period(end, "M")
+    missing = [str(month) for month in pd.period_range(start, end, freq="M") if month not in months]
+    if missing:
+        raise FileNotFoundError(f"no {kind} partitions for {', '.join(missing)}")
+
+    counts = cumulative[:, months.index(end) + 1] - cumulative[:, months.index(start)]
+    keep = counts > 0
+    window = chains[keep].assign(event_count=counts[keep])
+    return window.sort_values('event_count', ascending=False)[columns]
+
+
+def range_csv_path(kind, start, end):
+    """Return a chain CSV for the months ``start`` to ``end``, written from the partitions if needed.
+
+    The file is rewritten when any partition in the range is newer, and its path
+    works everywhere a published window's does (``load_frame``, ``chart``, the pool).
+    """
+    start, end = pd.Period(start, "M"), pd.Period(end, "M")
+    path = os.path.join(PARTITION_DIR, "ranges", f"{kind}_{start}_{end}.csv")
+
+    def write():
+        sources = [partition_path(kind, month) for month in pd.period_range(start, end, freq="M")]
+        newest = max((os.stat(source).st_mtime_ns for source in sources if os.path.exists(source)), default=0)
+        if os.path.exists(path) and os.stat(path).st_mtime_ns >= newest:
+            return path
+        df = range_frame(kind, start, end)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+        return path
+
+    return RANGE_FILES.do(path, write)
+
+
+def all_months():
+    """Every month with a partition of any kind, as "YYYY-MM" strings"""
+    return sorted({str(month) for kind in KINDS for month in available_months(kind)})
+
+
+def period_csv_path(direction, period, selected_customer=ALL_CUSTOMERS):
+    """``chain_csv_path`` for a fixed duration, or a month range ``(start, end)`` from the partitions"""
+    if period in DURATION_MONTHS:
+        return chain_csv_path(direction, period, selected_customer)
+    return range_csv_path(kind_of(direction, selected_customer), *period)
+
+
+def period_label(period):
+    if period in DURATION_MONTHS:
+        return period
+    start, end = period
+    return str(start) if start == end else f"{start} – {end}"
+
+
+def period_months(period):
+    """How many months a duration or month range covers, for per-month comparisons"""
+    if period in DURATION_MONTHS:
+        return DURATION_MONTHS[period]
+    start, end = period
+    return len(pd.period_range(start, end, freq="M"))
+
+
+# ---------------------- Rolling Windows ----------------------
+
+def rolling_windows(kind, end=None, durations=DURATION_MONTHS):
+    """Return ``{duration: frame}`` for the windows ending with month ``end`` (default: newest partition).
+
+    Windows that would need a missing month are left out, and logged as errors: the
+    previously published file for that window stays in place and goes stale.
+    """
+    months = available_months(kind)
+    if not months:
+        return {}
+    end = pd.Period(end, "M") if end is not None else months[-1]
+
+    windows = {}
+    for duration, n in durations.items():
+        try:
+            windows[duration] = range_frame(kind, end - (n - 1), end)
+        except FileNotFoundError as e:
+            logger.error("%s %s window not derived, keeping the old file: %s", kind, duration, e)
+    return windows
+
+
+def derive_windows(kinds=KINDS, end=None):
+    """Publish the 1/3/6/12-month chain CSVs of every ``kind`` that has partitions; returns the paths written"""
+    written = []
+    for kind in kinds:
+        direction, customer = KINDS[kind]
+        for duration, df in rolling_windows(kind, end).items():
+            written.append(publish_csv(df, chain_csv_path(direction, duration, customer)))
+            logger.info("derived %s %s from partitions: %d chains", kind, duration, len(df))
+    return written
+
+
+# ---------------------- Trend ----------------------
+
+def trend(direction, selected_customer=ALL_CUSTOMERS, months=12, top_n=5):
+    """Monthly event volume by partner for the last ``months`` partitions.
+
+    Returns a frame indexed by month ("YYYY-MM") with one column per partner: the
+    ``top_n`` direct partners of ``selected_customer`` (or, for "All Customers", the
+    busiest base customers) over the whole range, plus "Other". Empty without partitions.
+    """
+    kind = kind_of(direction, selected_customer)
+    partner = 'customer' if selected_customer == ALL_CUSTOMERS else 'customer_1'
+    volumes = {}
+    for month in available_months(kind)[-months:]:
+        df = filter_customer(load_frame(partition_path(kind, month), strip=True), selected_customer)
+        if partner not in df.columns:
+            continue
+        volumes[str(month)] = df.groupby(partner, observed=True)['event_count'].sum()
+
+    table = pd.DataFrame(volumes).T.fillna(0).astype('int64')
+    table = table.drop(columns=[''], errors='ignore')
+    if table.empty:
+        return table
+
+    top = table.sum().nlargest(top_n).index
+    rest = table.columns.difference(top)
+    result = table[top].copy()
+    if len(rest):
+        result['Other'] = table[rest].sum(axis=1)
+    result.index.name = 'month'
+    result.columns.name = None
+    return result
@@ -0,0 +1,114 @@
+"""Per-rerun timing spans for the dashboard pages.
+
+Each page creates a ``PhaseTimer`` at the top of a rerun, wraps its phases in
+``timer.span(...)`` and calls ``timer.emit()`` at the end:
+
+    timer = PhaseTimer("partner_flow")
+    with timer.span("csv_load", path=path):
+        df = load_chain_csv(path)
+    timer.annotate(customer=selected_customer, duration=duration)
+    timer.emit()
+
+``emit`` logs one JSON line per rerun on the ``icicle.perf`` logger, logs every
+span slower than ``PERF_SLOW_MS`` (default 1000) as a warning tagged with the
+customer and duration, and appends the record to ``PERF_LOG_FILE`` when set.
+Span durations also feed the histograms in ``metrics``.
+"""
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import metrics
+
+
+logger = logging.getLogger("icicle.perf")
+
+
+class PhaseTimer:
+    def __init__(self, page, slow_ms=None):
+        self.page = page
+        self.slow_ms = float(os.getenv("PERF_SLOW_MS", "1000")) if slow_ms is None else slow_ms
+        self.fields = {}
+        self.spans = []
+        self.started = time.perf_counter()
+
+    def annotate(self, **fields):
+        """Attach rerun-level fields such as ``customer`` and ``duration``"""
+        self.fields.update(fields)
+
+    @contextmanager
+    def span(self, phase, **fields):
+        """Time the wrapped block; spans are recorded even when it raises or calls ``st.stop()``"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append({
+                "phase": phase,
+                "ms": round((time.perf_counter() - start) * 1000, 2),
+                **fields,
+            })
+
+    def total_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    def rows(self):
+        """Spans as table rows, slowest first, with their share of the rerun"""
+        total = self.total_ms() or 1
+        return [
+            {**span, "share": f"{span['ms'] / total * 100:.1f}%", "slow": span["ms"] >= self.slow_ms}
+            for span in sorted(self.spans, key=lambda span: span["ms"], reverse=True)
+        ]
+
+    def record(self):
+        return {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "page": self.page,
+            **self.fields,
+            "total_ms": self.total_ms(),
+            "spans": self.spans,
+        }
+
+    def emit(self):
+        """Send the rerun record to the log sink and return it"""
+        record = self.record()
+        logger.info(json.dumps(record, default=str))
+
+        for span in self.spans:
+            if span["ms"] >= self.slow_ms:
+                logger.warning(
+                    "slow phase %s on %s: %.0f ms (customer=%s, duration=%s)",
+                    span["phase"], self.page, span["ms"],
+                    self.fields.get("customer"), self.fields.get("duration")
+                )
+
+        path = os.getenv("PERF_LOG_FILE")
+        if path:
+            try:
+                with open(path, "a") as file:
+                    file.write(json.dumps(record, default=str) + "\n")
+            except OSError as e:
+                logger.warning("could not write %s: %s", path, e)
+
+        metrics.observe_rerun(record)
+        try:
+            metrics.write_textfile()
+        except OSError as e:
+            logger.warning("could not write metrics file: %s", e)
+        return record
+
+
+class NullTimer:
+    """Stand-in for callers that don't trace; every span is a no-op"""
+
+    def annotate(self, **fields):
+        pass
+
+    def span(self, phase, **fields):
+        return nullcontext()
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,128 @@
+"""Capture a cProfile and tracemalloc snapshot of one dashboard rerun.
+
+    with profile_rerun("partner_flow", timer.fields):
+        ...
+
+Every profiled rerun writes three files to ``PROFILE_DIR`` (default ``profiles/``),
+named after the page, customer and duration:
+
+    <stamp>_<page>_<customer>_<duration>.prof       # pstats / snakeviz
+    <stamp>_<page>_<customer>_<duration>.snapshot   # tracemalloc.Snapshot.load
+    <stamp>_<page>_<customer>_<duration>.txt        # context, top functions and allocations
+
+Only the newest ``PROFILE_KEEP`` (default 20) reruns are kept.
+"""
+import cProfile
+import glob
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# tracemalloc is process-wide: it runs while any profiled rerun is active
+_tracing_lock = threading.Lock()
+_active_reruns = 0
+_started_tracing = False
+
+
+def profiling_allowed():
+    """Profiling is opt-in per deployment; the ``?profile=1`` switch is ignored unless this is on"""
+    return os.getenv("PROFILING_ENABLED", "False") == "True"
+
+
+def _slug(value, max_len=40):
+    return re.sub(r'[^A-Za-z0-9]+', '-', str(value)).strip('-')[:max_len] or "none"
+
+
+def _start_tracing():
+    global _active_reruns, _started_tracing
+    with _tracing_lock:
+        if _active_reruns == 0:
+            _started_tracing = not tracemalloc.is_tracing()
+            if _started_tracing:
+                tracemalloc.start(10)
+            tracemalloc.reset_peak()
+        _active_reruns += 1
+
+
+def _stop_tracing():
+    """Snapshot and peak for one rerun; tracing stops when the last active rerun leaves"""
+    global _active_reruns
+    with _tracing_lock:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        _active_reruns -= 1
+        if _active_reruns == 0 and _started_tracing:
+            tracemalloc.stop()
+    return snapshot, peak
+
+
+@contextmanager
+def profile_rerun(page, context, directory=None):
+    """Profile the wrapped block and save the results when it exits, even through ``st.stop()``.
+
+    ``context`` is read on exit, so fields added during the rerun (e.g. ``timer.fields``)
+    end up in the file names and summary. Overlapping reruns share one tracemalloc
+    session, so their peaks and snapshots include each other's allocations.
+    """
+    directory = directory or PROFILE_DIR
+    _start_tracing()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        snapshot, peak = _stop_tracing()
+        save_profile(page, dict(context), profiler, snapshot, elapsed, peak, directory)
+
+
+def save_profile(page, context, profiler, snapshot, elapsed, peak, directory):
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    base = os.path.join(directory, "_".join([
+        stamp, page, _slug(context.get("customer")), _slug(context.get("duration"))
+    ]))
+
+    profiler.dump_stats(base + ".prof")
+    snapshot.dump(base + ".snapshot")
+
+    stats_text = io.StringIO()
+    pstats.Stats(profiler, stream=stats_text).sort_stats("cumulative").print_stats(30)
+    allocations = snapshot.statistics("lineno")[:20]
+
+    with open(base + ".txt", "w") as file:
+        file.write(f"page: {page}\n")
+        for key, value in context.items():
+            file.write(f"{key}: {value}\n")
+        file.write(f"wall time: {elapsed * 1000:,.1f} ms\n")
+        file.write(f"peak traced memory: {peak / 1024 / 1024:,.1f} MB\n\n")
+        file.write("Top allocations by line\n")
+        for stat in allocations:
+            file.write(f"  {stat}\n")
+        file.write("\n")
+        file.write(stats_text.getvalue())
+
+    prune_profiles(directory)
+    return base
+
+
+def prune_profiles(directory, keep=None):
+    """Delete all but the newest ``keep`` profiled reruns"""
+    keep = int(os.getenv("PROFILE_KEEP", "20")) if keep is None else keep
+    runs = sorted(glob.glob(os.path.join(directory, "*.prof")))
+    for prof in runs[:-keep] if keep > 0 else runs:
+        stem = prof[:-len(".prof")]
+        for suffix in (".prof", ".snapshot", ".txt"):
+            if os.path.exists(stem + suffix):
+                os.remove(stem + suffix)
@@ -22,7 +22,7 @@ cte AS (
     AND e.type = 'Incident' 
     AND e.created_at >= DATE_TRUNC('month', ADD_MONTHS(CURRENT_DATE, -{period}))
 
-    AND e.created_at < DATE_TRUNC('month', CURRENT_DATE) 
+    AND e.created_at < DATE_TRUNC('month', ADD_MONTHS(CURRENT_DATE, -{end})) 
     AND e.status NOT IN (3,10,16,18)
 )
 , ranked_data AS (
@@ -97,7 +97,7 @@ cte AS (
     AND e.type = 'Incident' 
     AND e.created_at >= DATE_TRUNC('month', ADD_MONTHS(CURRENT_DATE, -{period}))
 
-    AND e.created_at < DATE_TRUNC('month', CURRENT_DATE) 
+    AND e.created_at < DATE_TRUNC('month', ADD_MONTHS(CURRENT_DATE, -{end})) 
     AND e.status NOT IN (3,10,16,18)
     And e.id not in (select event_id from dispatch_table_cte)
 )
@@ -0,0 +1,138 @@
+"""Generate synthetic chain CSVs in the same schema as the extracted files.
+
+    python synthetic_chains.py synthetic/chains_1m.csv --rows 1000000 --customers 5000
+    python synthetic_chains.py synthetic/dirty.csv --rows 50000 --dirty 0.05 --dirty-headers
+
+Customers are drawn with Zipf-like popularity, event counts follow a Pareto
+distribution and chain depths follow ``--depths`` weights for hops 1..6.
+``--dirty`` injects zero-width spaces, padding and non-ASCII characters into
+that fraction of names; ``--dirty-headers`` adds stray quotes and spaces to the
+header row. The loaders are expected to read either form back cleanly.
+"""
+import argparse
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+from chart_engine import MAX_HOPS
+
+
+COLUMNS = ["event_count", "customer", "customer_id"] + [
+    col for i in range(1, MAX_HOPS + 1) for col in (f"customer_{i}", f"customer_{i}_id")
+]
+DEFAULT_DEPTHS = (45, 30, 14, 7, 3, 1)
+
+_DIRTY_FORMS = (
+    lambda name, pos: name[:pos] + "\u200b" + name[pos:],
+    lambda name, pos: f"  {name} ",
+    lambda name, pos: name + "\ufeff",
+    lambda name, pos: name[:pos] + "\u00e9" + name[pos:],
+)
+_SUFFIXES = ("Inc", "LLC", "Ltd", "Logistics", "Tire Service", "Truck Repair", "Transport")
+
+
+def customer_pool(n_customers, seed=0):
+    """Return ``n_customers`` distinct partner names and their ids"""
+    rng = np.random.default_rng(seed)
+    suffixes = rng.choice(_SUFFIXES, size=n_customers)
+    names = np.array([f"Partner {i:05d} {suffix}" for i, suffix in enumerate(suffixes)], dtype=object)
+    ids = np.arange(1000, 1000 + n_customers)
+    return names, ids
+
+
+def generate_frame(rows, customers=1000, alpha=1.2, skew=1.1, depths=DEFAULT_DEPTHS,
+                   dirty=0.0, seed=0):
+    """Build a synthetic chain DataFrame with the extracted CSV columns.
+
+    ``alpha`` is the Pareto shape of event counts (smaller = heavier tail), ``skew``
+    the Zipf exponent of customer popularity and ``depths`` relative weights for
+    chains of 1..6 hops.
+    """
+    rng = np.random.default_rng(seed)
+    names, ids = customer_pool(customers, seed)
+
+    popularity = 1.0 / np.arange(1, customers + 1) ** skew
+    popularity /= popularity.sum()
+    picks = rng.choice(customers, size=(rows, MAX_HOPS + 1), p=popularity)
+
+    # Nobody forwards to themselves: bump any hop that repeats the previous one
+    for i in range(1, MAX_HOPS + 1):
+        repeats = picks[:, i] == picks[:, i - 1]
+        picks[repeats, i] = (picks[repeats, i] + 1) % customers
+
+    weights = np.asarray(depths, dtype=float)
+    depth = rng.choice(np.arange(1, len(weights) + 1), size=rows, p=weights / weights.sum())
+
+    data = {
+        "event_count": (np.floor(rng.pareto(alpha, rows) * 10) + 1).astype(np.int64),
+        "customer": names[picks[:, 0]],
+        "customer_id": ids[picks[:, 0]],
+    }
+    for i in range(1, MAX_HOPS + 1):
+        present = depth >= i
+        data[f"customer_{i}"] = np.where(present, names[picks[:, i]], "")
+        data[f"customer_{i}_id"] = pd.Series(ids[picks[:, i]]).where(present).astype("Int64")
+
+    df = pd.DataFrame(data, columns=COLUMNS)
+    if dirty > 0:
+        inject_dirty_names(df, dirty, rng)
+    return df
+
+
+def inject_dirty_names(df, fraction, rng):
+    """Corrupt ``fraction`` of the non-empty name cells in place"""
+    for col in ["customer"] + [f"customer_{i}" for i in range(1, MAX_HOPS + 1)]:
+        mask = (df[col] != "") & (rng.random(len(df)) < fraction)
+        if not mask.any():
+            continue
+        forms = rng.integers(len(_DIRTY_FORMS), size=int(mask.sum()))
+        df.loc[mask, col] = [
+            _DIRTY_FORMS[form](name, len(name) // 2)
+            for name, form in zip(df.loc[mask, col], forms)
+        ]
+
+
+def dirty_header(columns, rng):
+    """Return the header row with stray quotes and padding around the column names"""
+    forms = (' {}', '{}"', ' "{}" ', '{} ')
+    return ",".join(forms[rng.integers(len(forms))].format(col) for col in columns)
+
+
+def write_csv(df, path, dirty_headers=False, seed=0):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if not dirty_headers:
+        df.to_csv(path, index=False, quoting=csv.QUOTE_MINIMAL)
+        return
+
+    with open(path, "w", newline="") as file:
+        file.write(dirty_header(df.columns, np.random.default_rng(seed)) + "\n")
+        df.to_csv(file, index=False, header=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic chain CSV for scale testing")
+    parser.add_argument("output", help="CSV file to write")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--customers", type=int, default=1000, help="size of the partner name pool")
+    parser.add_argument("--alpha", type=float, default=1.2, help="Pareto shape of event counts")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of customer popularity")
+    parser.add_argument("--depths", default=",".join(map(str, DEFAULT_DEPTHS)),
+                        help="comma-separated weights for chains of 1..6 hops")
+    parser.add_argument("--dirty", type=float, default=0.0, help="fraction of names to corrupt")
+    parser.add_argument("--dirty-headers", action="store_true", help="add stray quotes/spaces to the header")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    depths = [float(w) for w in args.depths.split(",")]
+    if len(depths) > MAX_HOPS:
+        parser.error(f"--depths takes at most {MAX_HOPS} weights")
+
+    df = generate_frame(args.rows, args.customers, args.alpha, args.skew, depths, args.dirty, args.seed)
+    write_csv(df, args.output, args.dirty_headers, args.seed)
+    print(f"Wrote {len(df):,} rows ({df['event_count'].sum():,} events) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import pandas as pd
+import pytest
+
+from chart_engine import (
+    aggregate_paths, build_chart, build_downstream_chart, build_tree, build_upstream_chart, chain_records,
+    fold_tail, merge_trees, record_chain, top_paths, top_paths_by_depth, tree_delta
+)
+
+
+def chains_frame(rows):
+    """A chain CSV frame from ``(event_count, customer, hop 1, hop 2, ...)`` tuples"""
+    columns = ['event_count', 'customer'] + [f'customer_{i}' for i in range(1, 7)]
+    df = pd.DataFrame([list(row) + [''] * (len(columns) - len(row)) for row in rows], columns=columns)
+    df['original_customer'] = df['customer']
+    df['customer_cleaned'] = df['customer'].str.strip().str.lower()
+    return df
+
+
+CHAINS = chains_frame([
+    (10, "Acme", "Beta", "Gamma"),
+    (5, "Acme", "Beta"),
+    (3, "Acme", "Delta", "Gamma", "Epsilon"),
+    (7, "Zeta", "Beta"),
+    (0, "Zeta", "Omega"),
+])
+
+
+def node(labels, parents, path):
+    """Position of the node reached by following ``path`` labels from the root"""
+    current = 0
+    for label in path:
+        current = next(i for i, (l, p) in enumerate(zip(labels, parents)) if p == current and l == label)
+    return current
+
+
+# ---------------------- Chains ----------------------
+
+def test_record_chain_skips_empty_hops():
+    record = {'customer': ' Acme ', 'customer_1': 'Beta', 'customer_2': '', 'customer_3': 'Gamma', 'customer_4': None}
+    assert record_chain(record) == ['Acme', 'Beta', 'Gamma']
+
+
+def test_aggregate_paths_skips_empty_rows_and_cuts_at_max_hops():
+    aggregated = aggregate_paths(chain_records(CHAINS), max_hops=1)
+    assert aggregated == {('Acme', 'Beta'): 15, ('Acme', 'Delta'): 3, ('Zeta', 'Beta'): 7}
+
+
+def test_aggregate_paths_min_hops_drops_short_chains():
+    aggregated = aggregate_paths(chain_records(CHAINS), min_hops=2)
+    assert aggregated == {('Acme', 'Beta', 'Gamma'): 10, ('Acme', 'Delta', 'Gamma', 'Epsilon'): 3}
+
+
+# ---------------------- Trees ----------------------
+
+def test_build_tree_rolls_totals_up():
+    labels, parents, values, ids, totals, leaf_values = build_tree(
+        {('A', 'B'): 4, ('A', 'B', 'C'): 6, ('A', 'D'): 1}, root_label="root", hop_labels=False
+    )
+    assert ids == list(range(len(labels)))
+    assert parents[0] is None
+    assert all(parents[i] < i for i in ids[1:])
+    assert totals[0] == 11
+    assert totals[node(labels, parents, ['A'])] == 11
+    assert totals[node(labels, parents, ['A', 'B'])] == 10
+    # Inner nodes carry no value of their own; their chain-end counts are in leaf_values
+    assert values[node(labels, parents, ['A', 'B'])] == 0
+    assert leaf_values[node(labels, parents, ['A', 'B'])] == 4
+    assert values[node(labels, parents, ['A', 'B', 'C'])] == 6
+
+
+@pytest.mark.parametrize("builder", [build_upstream_chart, build_downstream_chart])
+def test_chart_totals_match_events(builder):
+    labels, parents, values, ids, totals, leaf_values = builder(CHAINS)
+    assert totals[0] == CHAINS['event_count'].sum()
+    assert sum(leaf_values.values()) == totals[0]
+
+
+def test_selected_customer_is_the_only_base():
+    labels, parents, _, _, totals, _ = build_chart(CHAINS, "acme", hop_labels=False)
+    assert [labels[i] for i, parent in enumerate(parents) if parent == 0] == ["Acme"]
+    assert totals[0] == 18
+
+
+def test_upstream_labels_hops_and_downstream_does_not():
+    labels_up = build_upstream_chart(CHAINS)[0]
+    labels_down = build_downstream_chart(CHAINS, hop_labels=False)[0]
+    assert "Beta (Hop 1)" in labels_up and "Gamma (Hop 2)" in labels_up
+    assert "Beta" in labels_down and not any("(Hop" in label for label in labels_down)
+
+
+def test_hop_filter_cuts_depth_but_keeps_totals():
+    labels, parents, values, ids, totals, _ = build_upstream_chart(CHAINS, "acme", "Hop 1")
+    depth = {0: 0}
+    for i in ids[1:]:
+        depth[i] = depth[parents[i]] + 1
+    assert max(depth.values()) == 2  # root, customer, hop 1
+    assert totals[0] == 18
+    assert totals[node(labels, parents, ['Acme', 'Beta (Hop 1)'])] == 15
+
+
+# ---------------------- Folding ----------------------
+
+def test_fold_tail_keeps_totals():
+    aggregated = {('A', f'P{i}'): i for i in range(1, 41)}
+    labels, parents, values, ids, totals, _ = build_tree(aggregated, hop_labels=False)
+    f_labels, f_parents, f_values, f_ids, f_totals, folded = fold_tail(
+        labels, parents, values, ids, totals, max_children=5
+    )
+    a = node(labels, parents, ['A'])
+    children = [i for i, parent in zip(f_ids, f_parents) if parent == a]
+    assert len(children) == 6
+    assert sum(f_totals[f_ids.index(i)] for i in children) == totals[a]
+    assert sum(f_values) == totals[0]
+    (other, replaced), = folded.items()
+    assert f_labels[f_ids.index(other)].startswith("Other")
+    assert len(replaced) == 35
+
+
+# ---------------------- Top paths ----------------------
+
+AGGREGATED = {('A', 'B'): 5, ('A', 'C'): 20, ('A', 'B', 'C'): 10, ('D',): 15, ('A', 'C', 'E'): 10}
+
+
+def test_top_paths_ranks_heaviest_first():
+    ranked = top_paths(AGGREGATED, n=3)
+    assert [entry['path'] for entry in ranked] == [('A', 'C'), ('D',), ('A', 'B', 'C')]
+    assert [entry['rank'] for entry in ranked] == [1, 2, 3]
+    assert ranked[0]['share'] == pytest.approx(20 / 60 * 100)
+    assert ranked[0]['hops'] == 1
+
+
+def test_top_paths_by_depth_keeps_n_per_depth():
+    by_depth = top_paths_by_depth(AGGREGATED, n=1)
+    assert sorted(by_depth) == [0, 1, 2]
+    assert by_depth[1][0]['path'] == ('A', 'C')
+    # Equal counts keep the first chain seen
+    assert by_depth[2][0]['path'] == ('A', 'B', 'C')
+    assert by_depth[0][0]['share'] == pytest.approx(15 / 60 * 100)
+
+
+# ---------------------- Comparing windows ----------------------
+
+def test_merge_trees_aligns_shared_nodes():
+    current = build_tree({('A', 'B'): 6, ('A', 'C'): 4}, hop_labels=False)
+    baseline = build_tree({('A', 'B'): 3, ('D',): 9}, hop_labels=False)
+    labels, parents, now, before = merge_trees(current, baseline)
+    assert len(labels) == 5  # root, A, B, C, D
+    assert (now[0], before[0]) == (10, 12)
+    b = node(labels, parents, ['A', 'B'])
+    assert (now[b], before[b]) == (6, 3)
+    d = node(labels, parents, ['D'])
+    assert (now[d], before[d]) == (0, 9)
+
+
+def test_tree_delta_compares_monthly_rates():
+    current = build_tree({('A', 'B'): 6}, hop_labels=False)
+    baseline = build_tree({('A', 'B'): 12, ('A', 'C'): 24}, hop_labels=False)
+    labels, parents, values, ids, totals, now, before = tree_delta(current, baseline, 1, 12)
+    b, c = node(labels, parents, ['A', 'B']), node(labels, parents, ['A', 'C'])
+    assert (now[b], before[b]) == (6, 1)
+    assert (now[c], before[c]) == (0, 2)
+    assert totals[b] == 6 and values[b] == 6
+    assert values[node(labels, parents, ['A'])] == 0
@@ -2,18 +2,50 @@ import os
 from dotenv import load_dotenv
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 
 from urllib.parse import unquote
 import requests
-import difflib
-import re
 import time
 import hashlib
 import secrets
+
+from chart_engine import (
+    safe_int, deep_clean, filter_customer, chain_contains, deepest_hop,
+    chain_records, aggregate_paths, top_paths, top_paths_by_depth, format_path,
+    fold_tail, subtree, drill_targets, tree_delta, fold_delta, top_changes
+)
+from chart_data import DURATIONS, chain_csv_path, records_page
+from chart_cache import load_frame, chart, chart_key, figure, positions, records
+from data_checks import verdict
+from customer_aliases import describe, load_aliases, resolve_id, resolve_name, search
+from chart_figures import delta_figure, partner_figure, trend_figure
+from perf_trace import PhaseTimer
+from metrics import TOKEN_SECONDS
+from profiling import profiling_allowed, profile_rerun
+from partitions import (
+    CUSTOM_RANGE, all_months, available_months, kind_of, period_csv_path, period_label, period_months, trend
+)
+
 def render_upstream_chart_page():
+    """Render the partner flow page; ``?profile=1`` profiles this rerun when ``PROFILING_ENABLED=True``"""
+    timer = PhaseTimer("partner_flow")
+    if not (profiling_allowed() and st.query_params.get("profile") == "1"):
+        _render_upstream_chart_page(timer)
+        return
+
+    # One rerun only: drop the switch so widget interactions afterwards aren't profiled
+    del st.query_params["profile"]
+    with profile_rerun("partner_flow", timer.fields):
+        _render_upstream_chart_page(timer)
+    st.toast("🧪 Profile saved for this rerun")
+
+
+def _render_upstream_chart_page(timer):
     UPSTREAM_COLOR = os.getenv("UPSTREAM_COLOR", "#D96F32")
     DOWNSTREAM_COLOR = os.getenv("DOWNSTREAM_COLOR", "#4C78A8")
+    MAX_CHILDREN = int(os.getenv("ICICLE_MAX_CHILDREN", "25"))
+    MAX_NODES_PER_LEVEL = int(os.getenv("ICICLE_MAX_NODES_PER_LEVEL", "200"))
+    RECORDS_PAGE_SIZE = int(os.getenv("RECORDS_PAGE_SIZE", "50"))
     st.set_page_config(page_title="Customer Chain Analysis beta version", layout="wide")
 
 
@@ -35,9 +67,11 @@ def render_upstream_chart_page():
         backend_url = os.getenv("VALIDATION_ENDPOINT")
         headers = {"x-api-key": expected_secret, "Content-Type": "application/json"}
         
+        started = time.perf_counter()
         try:
             payload = {"token": token}
             response = requests.post(backend_url, json=payload, headers=headers)
+            TOKEN_SECONDS.observe(time.perf_counter() - started, result=str(response.status_code))
             
             if response.status_code == 200:
                 data = response.json()
@@ -45,6 +79,7 @@ def render_upstream_chart_page():
             else:
                 return None, None, None
         except Exception as e:
+            TOKEN_SECONDS.observe(time.perf_counter() - started, result="error")
             st.error(f"Token validation error: {e}")
             return None, None, None
 
@@ -113,30 +148,8 @@ def render_upstream_chart_page():
             st.stop()
 
     # Run authentication check
-    check_authentication()
-
-    # ---------------------- Helper functions ----------------------
-
-    def clean_key(k):
-        return k.strip().strip('"').strip()
-
-    def clean_val(v):
-        if not v or not isinstance(v, str):
-            return ''
-        return v.strip()
-
-    def safe_int(val):
-        try:
-            return int(str(val).replace(',', '').strip())
-        except Exception:
-            return 0
-
-    def deep_clean(s):
-        if not isinstance(s, str):
-            return ''
-        s = re.sub(r'[\u200B-\u200D\uFEFF]', '', s)
-        s = s.encode('ascii', errors='ignore').decode()
-        return s.strip().lower()
+    with timer.span("auth"):
+        check_authentication()
 
     # ---------------------- Styling: Page & Custom CSS ----------------------
     st.markdown("""
@@ -290,10 +303,16 @@ def render_upstream_chart_page():
     # ---------------------- Duration Filter Section ----------------------
     st.markdown(" Select Duration")
 
+    range_months = all_months()
     duration = st.selectbox(
         "Duration",
-        ["1 Month", "3 Months", "6 Months", "1 Year"]
+        DURATIONS + ([CUSTOM_RANGE] if range_months else [])
     )
+    period = duration
+    if duration == CUSTOM_RANGE:
+        # Any run of months, summed from the monthly partitions
+        period = st.select_slider("Months", range_months, value=(range_months[max(0, len(range_months) - 3)], range_months[-1]))
+        duration = period_label(period)
 
 
 
@@ -311,31 +330,15 @@ def render_upstream_chart_page():
 
     # First, we need to load some initial data to get customer lists
     # Use default 1-month files for initial customer discovery
-    initial_downstream_df = pd.read_csv("duration/1month_data.csv")
-    initial_upstream_df = pd.read_csv("upstream_duration/up_1month_data.csv")
-
-    # Clean the initial data
-    initial_downstream_df.columns = [clean_key(col) for col in initial_downstream_df.columns]
-    initial_downstream_df.fillna('', inplace=True)
-    initial_downstream_df['original_customer'] = initial_downstream_df['customer']
-    initial_downstream_df['customer_cleaned'] = initial_downstream_df['customer'].astype(str).apply(deep_clean)
-
-    initial_upstream_df.columns = [clean_key(col) for col in initial_upstream_df.columns]
-    initial_upstream_df.fillna('', inplace=True)
-    initial_upstream_df['original_customer'] = initial_upstream_df['customer']
-    initial_upstream_df['customer_cleaned'] = initial_upstream_df['customer'].astype(str).apply(deep_clean)
-
-    # Add customer_id if it doesn't exist
-    if 'customer_id' not in initial_downstream_df.columns:
-        initial_downstream_df['customer_id'] = initial_downstream_df['customer_cleaned'].apply(lambda x: abs(hash(x)) % 10000)
-    if 'customer_id' not in initial_upstream_df.columns:
-        initial_upstream_df['customer_id'] = initial_upstream_df['customer_cleaned'].apply(lambda x: abs(hash(x)) % 10000)
+    initial_downstream_df = load_frame(chain_csv_path("downstream", "1 Month"), timer=timer)
+    initial_upstream_df = load_frame(chain_csv_path("upstream", "1 Month"), timer=timer)
 
     # Get unique customers from both datasets
-    downstream_customers = set(initial_downstream_df['customer_cleaned'].unique())
-    upstream_customers = set(initial_upstream_df['customer_cleaned'].unique())
-    all_customers = sorted(downstream_customers.union(upstream_customers))
+    with timer.span("customer_discovery"):
+        downstream_customers = set(initial_downstream_df['customer_cleaned'].unique())
+        upstream_customers = set(initial_upstream_df['customer_cleaned'].unique())
 
+    aliases = load_aliases()
     selected_customer = None
     customer_source = None  # Track how customer was selected
     customer_id = None
@@ -345,21 +348,13 @@ def render_upstream_chart_page():
         # Token authentication - auto-select the customer
         customer_id = st.session_state.get("token_customer_id")
         
-        # Look for customer ID in both datasets
-        downstream_match = initial_downstream_df[initial_downstream_df['customer_id'] == customer_id]
-        upstream_match = initial_upstream_df[initial_upstream_df['customer_id'] == customer_id]
-        
-        if not downstream_match.empty:
-            selected_customer = downstream_match['customer_cleaned'].iloc[0]
-            original_display = downstream_match['original_customer'].iloc[0]
-            customer_source = "token_downstream"
-        elif not upstream_match.empty:
-            selected_customer = upstream_match['customer_cleaned'].iloc[0]
-            original_display = upstream_match['original_customer'].iloc[0]
-            customer_source = "token_upstream"
-        else:
+        # Canonical id -> name from the alias table written at ingest
+        selected_customer = resolve_id(customer_id, aliases)
+        if selected_customer is None:
             st.error(f"❌ Token customer ID '{customer_id}' not found in any dataset.")
             st.stop()
+        original_display, _ = describe(selected_customer, aliases)
+        customer_source = "token"
             
         st.markdown(f'<div class="customer-info">🔗 <strong>Token Customer:</strong> <code>{original_display}</code> (ID: {customer_id})</div>', unsafe_allow_html=True)
 
@@ -368,21 +363,12 @@ def render_upstream_chart_page():
         try:
             customer_id = int(customer_id_from_url)
             
-            # Look for customer ID in both datasets
-            downstream_match = initial_downstream_df[initial_downstream_df['customer_id'] == customer_id]
-            upstream_match = initial_upstream_df[initial_upstream_df['customer_id'] == customer_id]
-            
-            if not downstream_match.empty:
-                selected_customer = downstream_match['customer_cleaned'].iloc[0]
-                original_display = downstream_match['original_customer'].iloc[0]
-                customer_source = "url_downstream"
-            elif not upstream_match.empty:
-                selected_customer = upstream_match['customer_cleaned'].iloc[0]
-                original_display = upstream_match['original_customer'].iloc[0]
-                customer_source = "url_upstream"
-            else:
+            selected_customer = resolve_id(customer_id, aliases)
+            if selected_customer is None:
                 st.error(f"❌ Customer ID '{customer_id}' not found in any dataset.")
                 st.stop()
+            original_display, _ = describe(selected_customer, aliases)
+            customer_source = "url_id"
                 
             st.markdown(f'<div class="customer-info">🔗 <strong>Customer loaded from URL:</strong> <code>{original_display}</code> (ID: {customer_id})</div>', unsafe_allow_html=True)
     
@@ -394,17 +380,11 @@ def render_upstream_chart_page():
     elif customer_from_url:
         # URL customer name parameter
         customer_from_url = deep_clean(unquote(customer_from_url))
-        if customer_from_url in all_customers:
-            selected_customer = customer_from_url
-            # Try to get original display name from either dataset
-            if customer_from_url in downstream_customers:
-                original_display = initial_downstream_df[initial_downstream_df['customer_cleaned'] == selected_customer]['original_customer'].iloc[0]
-                customer_id = initial_downstream_df[initial_downstream_df['customer_cleaned'] == selected_customer]['customer_id'].iloc[0]
-                customer_source = "url_name_downstream"
-            else:
-                original_display = initial_upstream_df[initial_upstream_df['customer_cleaned'] == selected_customer]['original_customer'].iloc[0]
-                customer_id = initial_upstream_df[initial_upstream_df['customer_cleaned'] == selected_customer]['customer_id'].iloc[0]
-                customer_source = "url_name_upstream"
+        resolved = resolve_name(customer_from_url, aliases)
+        if resolved is not None:
+            selected_customer = resolved
+            original_display, customer_id = describe(selected_customer, aliases)
+            customer_source = "url_name"
             
             st.markdown(f'<div class="customer-info">🔗 <strong>Customer loaded from URL:</strong> <code>{original_display}</code> (ID: {customer_id})</div>', unsafe_allow_html=True)
             # ✅ Unified debug banner after all customer types
@@ -412,7 +392,7 @@ def render_upstream_chart_page():
                 st.warning("⚙️ Debug mode is ON – extra analysis and validation sections are automatically shown.")
 
         else:
-            matches = difflib.get_close_matches(customer_from_url, all_customers, n=10, cutoff=0.3)
+            matches = search(customer_from_url, n=10, aliases=aliases)
             st.error(f"❌ Customer '{customer_from_url}' not found.")
             if matches:
                 selected_customer = st.selectbox("Did you mean one of these?", matches)
@@ -425,104 +405,51 @@ def render_upstream_chart_page():
         if st.session_state.get("auth_method") == "token":
             st.warning("🔗 Token authentication active but no specific customer provided.")
         
-        # Create display options with original names and IDs
+        # Type-ahead over the trigram index instead of one option per customer
+        query = st.text_input("Search Customer", placeholder="Type a customer name or ID")
+        with timer.span("customer_discovery", step="search"):
+            matches = search(query, n=20, aliases=aliases) if query else []
+            exact = resolve_id(query.strip(), aliases) if query.strip().isdigit() else None
+            if exact:
+                matches = [exact] + [name for name in matches if name != exact]
+
         display_options = ["All Customers"]
         customer_id_map = {}  # Map display names to IDs for reference
-        
-        for cust in all_customers:
-            if cust in downstream_customers:
-                original_name = initial_downstream_df[initial_downstream_df['customer_cleaned'] == cust]['original_customer'].iloc[0]
-                customer_id_temp = initial_downstream_df[initial_downstream_df['customer_cleaned'] == cust]['customer_id'].iloc[0]
-            else:
-                original_name = initial_upstream_df[initial_upstream_df['customer_cleaned'] == cust]['original_customer'].iloc[0]
-                customer_id_temp = initial_upstream_df[initial_upstream_df['customer_cleaned'] == cust]['customer_id'].iloc[0]
-            
+        for cust in matches:
+            original_name, customer_id_temp = describe(cust, aliases)
             display_text = f"{original_name} (ID: {customer_id_temp})"
             display_options.append(display_text)
             customer_id_map[display_text] = (cust, customer_id_temp)
 
-        selected_display = st.selectbox("Select Customer", display_options)
+        if query and not matches:
+            st.caption(f"No customer matches '{query}'.")
+        selected_display = st.selectbox("Select Customer", display_options, index=1 if matches else 0)
         if selected_display == "All Customers":
             selected_customer = "All Customers"
             customer_source = "manual_all"
         else:
             selected_customer, customer_id = customer_id_map[selected_display]
             customer_source = "manual_specific"
-            
 
+    timer.annotate(customer=selected_customer, duration=duration)
+            
 
 
 
-    # File mappings
-    downstream_file_map = {
-        "1 Month": "1month_data.csv",
-        "3 Months": "3month_data.csv", 
-        "6 Months": "6month_data.csv",
-        "1 Year": "1year_data.csv"
-    }
-
-    upstream_file_map = {
-        "1 Month": "up_1month_data.csv",
-        "3 Months": "up_3month_data.csv",
-        "6 Months": "up_6month_data.csv", 
-        "1 Year": "up_1year_data.csv"
-    }
-
-    # NEW: Shifted file mappings
-    shifted_downstream_file_map = {
-        "1 Month": "shifted_downstream_duration_1month.csv",
-        "3 Months": "shifted_downstream_duration_3month.csv",
-        "6 Months": "shifted_downstream_duration_6month.csv",
-        "1 Year": "shifted_downstream_duration_1year.csv"
-    }
-
-    shifted_upstream_file_map = {
-        "1 Month": "shifted_upstream_duration_1month.csv",
-        "3 Months": "shifted_upstream_duration_3month.csv",
-        "6 Months": "shifted_upstream_duration_6month.csv",
-        "1 Year": "shifted_upstream_duration_1year.csv"
-    }
-
-    # NOW: Choose file paths based on customer selection (after selected_customer is defined)
-    if selected_customer == "All Customers":
-        # Use original files for "All Customers"
-        downstream_csv_path = f"duration/{downstream_file_map[duration]}"
-        upstream_csv_path = f"upstream_duration/{upstream_file_map[duration]}"
-    else:
-        # Use shifted files for specific customers
-        downstream_csv_path = f"shifted_downstream_duration/{shifted_downstream_file_map[duration]}"
-        upstream_csv_path = f"shifted_upstream_duration/{shifted_upstream_file_map[duration]}"
 
     # ---------------------- Load & Clean Data ----------------------
+    # Original files for "All Customers", shifted files for specific customers
     try:
-        downstream_df = pd.read_csv(downstream_csv_path)
-        downstream_df.columns = [clean_key(col) for col in downstream_df.columns]
-        downstream_df.fillna('', inplace=True)
-        downstream_df['original_customer'] = downstream_df['customer']
-        downstream_df['customer_cleaned'] = downstream_df['customer'].astype(str).apply(deep_clean)
-        
-        # Add customer_id if it doesn't exist (assuming it might be in the CSV)
-        if 'customer_id' not in downstream_df.columns:
-            # Create a simple ID based on cleaned customer name for demo
-            downstream_df['customer_id'] = downstream_df['customer_cleaned'].apply(lambda x: abs(hash(x)) % 10000)
-            
+        downstream_csv_path = period_csv_path("downstream", period, selected_customer)
+        downstream_df = load_frame(downstream_csv_path, timer=timer)
     except FileNotFoundError:
         st.error("⚠️ No Downstream data available for the selected duration.")
 
         st.stop()
 
     try:
-        upstream_df = pd.read_csv(upstream_csv_path)
-        upstream_df.columns = [clean_key(col) for col in upstream_df.columns]
-        upstream_df.fillna('', inplace=True)
-        upstream_df['original_customer'] = upstream_df['customer']
-        upstream_df['customer_cleaned'] = upstream_df['customer'].astype(str).apply(deep_clean)
-        
-        # Add customer_id if it doesn't exist (assuming it might be in the CSV)
-        if 'customer_id' not in upstream_df.columns:
-            # Create a simple ID based on cleaned customer name for demo
-            upstream_df['customer_id'] = upstream_df['customer_cleaned'].apply(lambda x: abs(hash(x)) % 10000)
-            
+        upstream_csv_path = period_csv_path("upstream", period, selected_customer)
+        upstream_df = load_frame(upstream_csv_path, timer=timer)
     except FileNotFoundError:
         st.error("⚠️ No upstream data available for the selected duration.")
 
@@ -539,77 +466,31 @@ def render_upstream_chart_page():
     elif auth_method == "api_key":
         st.markdown('<div class="auth-info">🔑 <strong>API Key Access</strong> - Full system access</div>', unsafe_allow_html=True)
 
-    # ---------------------- Shared Filtering (DO NOT REPEAT ANYWHERE ELSE) ----------------------
-    def get_debug_data(df, chart_type, selected_customer, customer_id):
-        """FIXED: Proper filtering for upstream and downstream"""
+    # FIXED: Proper availability check for upstream
+    with timer.span("filter", step="availability"):
         if selected_customer == "All Customers":
-            return df
-        
-        if chart_type == "downstream":
-            # For downstream: filter by root customer only
-            return df[df['customer_cleaned'] == selected_customer]
-        else:  # upstream
-            return df[df['customer_cleaned'] == selected_customer]
+            downstream_available = True  
+            upstream_available = True    
+        else:
+            # For downstream: customer appears as ROOT in shifted files
+            downstream_available = selected_customer in set(downstream_df['customer_cleaned'].unique())
+            
+            # For upstream: customer appears ANYWHERE in the chain (more flexible)
+            upstream_available = (
+                selected_customer in set(upstream_df['customer_cleaned'].unique())
+                or chain_contains(upstream_df, selected_customer)
+            )
 
 
-    # FIXED: Proper availability check for upstream
-    if selected_customer == "All Customers":
-        downstream_available = True  
-        upstream_available = True    
-    else:
-        # For downstream: customer appears as ROOT in shifted files
-        downstream_available = selected_customer in set(downstream_df['customer_cleaned'].unique())
-        
-        # For upstream: customer appears ANYWHERE in the chain (more flexible)
-        upstream_available = False
-        if selected_customer in set(upstream_df['customer_cleaned'].unique()):
-            upstream_available = True
-        else:
-            # Check if customer appears anywhere in upstream chain
-            for i in range(1, 7):
-                col_name = f'customer_{i}'
-                if col_name in upstream_df.columns:
-                    upstream_df[f'{col_name}_cleaned'] = upstream_df[col_name].astype(str).apply(deep_clean)
-                    if selected_customer in set(upstream_df[f'{col_name}_cleaned'].unique()):
-                        upstream_available = True
-                        break
-
-
-    downstream_filtered = get_debug_data(downstream_df, "downstream", selected_customer, customer_id) if downstream_available else pd.DataFrame()
-    upstream_filtered = get_debug_data(upstream_df, "upstream", selected_customer, customer_id) if upstream_available else pd.DataFrame()
+    with timer.span("filter", step="filter_customer"):
+        downstream_filtered = filter_customer(downstream_df, selected_customer) if downstream_available else pd.DataFrame()
+        upstream_filtered = filter_customer(upstream_df, selected_customer) if upstream_available else pd.DataFrame()
    
 
     if selected_customer != "All Customers" and upstream_available and not upstream_filtered.empty:
         # Calculate maximum hop depth from the data
-        max_hop_depth = 0
-        for _, row in upstream_filtered.iterrows():
-            # Check if selected customer is the base customer
-            if deep_clean(row['customer']) == selected_customer:
-                # Count how many hops exist in this chain
-                hop_count = 0
-                for i in range(1, 7):
-                    if row.get(f'customer_{i}') and str(row.get(f'customer_{i}')).strip():
-                        hop_count += 1
-                    else:
-                        break
-                max_hop_depth = max(max_hop_depth, hop_count)
-            else:
-                # If selected customer appears later in chain, calculate from that position
-                customer_position = -1
-                for i in range(1, 7):
-                    if deep_clean(str(row.get(f'customer_{i}', ''))) == selected_customer:
-                        customer_position = i
-                        break
-                
-                if customer_position != -1:
-                    # Count remaining hops after the selected customer
-                    remaining_hops = 0
-                    for i in range(customer_position + 1, 7):
-                        if row.get(f'customer_{i}') and str(row.get(f'customer_{i}')).strip():
-                            remaining_hops += 1
-                        else:
-                            break
-                    max_hop_depth = max(max_hop_depth, remaining_hops)
+        with timer.span("filter", step="deepest_hop"):
+            max_hop_depth = deepest_hop(upstream_filtered, selected_customer)
         
         # Create hop options dynamically
         if max_hop_depth > 0:
@@ -633,204 +514,55 @@ def render_upstream_chart_page():
     st.markdown('</div>', unsafe_allow_html=True)
 
 
-    # ---------------------- Function to Build Icicle Chart Data ----------------------
-
-    def build_downstream_chart(df, selected_customer):
-        """Build downstream icicle chart data"""
-        # Filter data 
-        if selected_customer == "All Customers":
-            filtered_df = df
-        else:
-            filtered_df = df[df['customer_id'] == customer_id]
-
-        data = filtered_df.to_dict(orient='records')
-        
-        labels, parents, values, ids = [], [], [], []
-        node_children = {}
-        leaf_values = {}
-        calculated_totals = {}
-
-        root_id = "Customer Chain"
-        labels.append(root_id)
-        parents.append("")
-        ids.append(root_id)
-        node_children[root_id] = set()
-
-        # Build tree structure
-        for record in data:
-            customer = clean_val(record.get('original_customer', ''))
-            event_count = safe_int(record.get('event_count', 0))
-            if not customer or event_count == 0:
-                continue
-
-            # Build the chain
-            chain = [customer]
-            for i in range(1, 7):
-                key = f'customer_{i}'
-                cust = clean_val(record.get(key, ''))
-                if cust:
-                    chain.append(cust)
-                else:
-                    break
-
-            # Create nodes for the chain
-            path_ids = [root_id]
-            for i, name in enumerate(chain):
-                parent_id = "/".join(path_ids)
-                current_id = parent_id + "/" + name
-
-                # Track parent-child relationships
-                if parent_id not in node_children:
-                    node_children[parent_id] = set()
-                node_children[parent_id].add(current_id)
-
-                if current_id not in node_children:
-                    node_children[current_id] = set()
-
-                # Add to lists if not already present
-                if current_id not in ids:
-                    labels.append(name)
-                    parents.append(parent_id)
-                    ids.append(current_id)
-
-                path_ids.append(name)
-
-            # The final node in the chain gets the event count
-            leaf_id = "/".join(path_ids)
-            if leaf_id not in leaf_values:
-                leaf_values[leaf_id] = 0
-            leaf_values[leaf_id] += event_count
-
-        # Calculate totals
-        def calculate_node_total(node_id):
-            if node_id in calculated_totals:
-                return calculated_totals[node_id]
-            total = leaf_values.get(node_id, 0)
-            children = node_children.get(node_id, set())
-            for child_id in children:
-                total += calculate_node_total(child_id)
-            calculated_totals[node_id] = total
-            return total
-
-        for node_id in ids:
-            calculate_node_total(node_id)
-
-        # Assign values for chart sizing
-        values = []
-        for node_id in ids:
-            children = node_children.get(node_id, set())
-            if children:  # Parent node
-                values.append(0)
-            else:  # Leaf node
-                values.append(leaf_values.get(node_id, 0))
-
-        return labels, parents, values, ids, calculated_totals
-        
-    # REPLACE your build_upstream_chart function with this FIXED version:
-
-    def build_upstream_chart(df, selected_customer, hop_filter="All Hops"):
-        """Build upstream icicle chart data with PROPER hop filtering"""
-        has_expanded_chain = False
-
-        filtered_df = get_debug_data(df, "upstream", selected_customer, None)
-        filtered_df = filtered_df[filtered_df['event_count'].notnull()]
-        data = filtered_df.to_dict(orient='records')
-
-        from collections import defaultdict
-
-        labels, parents, values, ids = [], [], [], []
-        node_children = {}
-        leaf_values = {}
-        calculated_totals = {}
-        aggregated = defaultdict(int)
-
-        root_id = "Customer Chain"
-        labels.append(root_id)
-        parents.append("")
-        ids.append(root_id)
-        node_children[root_id] = set()
-
-        max_hops = 6
-        if hop_filter != "All Hops":
-            max_hops = int(hop_filter.split()[1])
-
-        for record in data:
-            event_count = safe_int(record.get('event_count', 0))
-            if event_count == 0:
-                continue
-
-            full_chain = []
-            base_customer = clean_val(record.get('customer', ''))
-            if base_customer:
-                full_chain.append(base_customer)
-
-            for i in range(1, 7):
-                cust = clean_val(record.get(f'customer_{i}', ''))
-                if cust:
-                    full_chain.append(cust)
-
-            if selected_customer == "All Customers":
-                final_chain = full_chain
-            else:
-                try:
-                    customer_position = next(i for i, c in enumerate(full_chain) if deep_clean(c) == selected_customer)
-                    final_chain = full_chain[customer_position:customer_position + max_hops + 1]
-                except StopIteration:
-                    continue  # skip this row if customer not found
-
-            if final_chain and len(final_chain) > 1:
-                has_expanded_chain = True
-
-            aggregated[tuple(final_chain)] += event_count
-
-        for chain, event_count in aggregated.items():
-            current_path = [root_id]
-            for i, customer_name in enumerate(chain):
-                parent_id = "/".join(current_path)
-                display_name = customer_name if i == 0 else f"{customer_name} (Hop {i})"
-                current_id = parent_id + "/" + display_name
-
-                node_children.setdefault(parent_id, set()).add(current_id)
-                node_children.setdefault(current_id, set())
-
-                if current_id not in ids:
-                    labels.append(display_name)
-                    parents.append(parent_id)
-                    ids.append(current_id)
-
-                current_path.append(display_name)
-
-            final_id = "/".join(current_path)
-            leaf_values[final_id] = event_count
-
-        def calculate_node_total(node_id):
-            if node_id in calculated_totals:
-                return calculated_totals[node_id]
-
-            total = leaf_values.get(node_id, 0)
-            children = node_children.get(node_id, set())
-
-            for child_id in children:
-                total += calculate_node_total(child_id)
-
-            calculated_totals[node_id] = total
-            return total
-
-        for node_id in ids:
-            calculate_node_total(node_id)
-
-        values = []
-        for node_id in ids:
-            children = node_children.get(node_id, set())
-            if children:
-                values.append(0)
-            else:
-                values.append(leaf_values.get(node_id, 0))
-
-        return labels, parents, values, ids, calculated_totals, leaf_values, has_expanded_chain
-
-
-
+    # ---------------------- Tail Folding & Drill-down ----------------------
+    def compact_tree(labels, parents, values, ids, totals, key):
+        """Fold long tails into "Other" nodes and let the user drill into a subtree"""
+        labels_c, parents_c, values_c, ids_c, totals_c, folded = fold_tail(
+            labels, parents, values, ids, totals, MAX_CHILDREN, MAX_NODES_PER_LEVEL
+        )
+        if not folded:
+            return labels, parents, values, ids, totals, None
+
+        targets = drill_targets(labels_c, parents_c, ids_c, totals_c, folded)
+        drill_id = st.selectbox(
+            "🔎 Drill into",
+            [None] + list(targets),
+            format_func=lambda node_id: "Whole chart" if node_id is None else targets[node_id],
+            key=key
+        )
+        st.caption(f"Showing the largest partners; {sum(len(rest) for rest in folded.values()):,} smaller ones are grouped under \"Other\".")
+        if drill_id is None:
+            return labels_c, parents_c, values_c, ids_c, totals_c, None
+
+        return fold_tail(
+            *subtree(labels, parents, values, ids, totals, drill_id), MAX_CHILDREN, MAX_NODES_PER_LEVEL
+        )[:5] + (drill_id,)
+
+
+    def shared(fetch, *args, **kwargs):
+        """Fetch from the shared cache; while a worker or another session builds the value the rerun stays interruptible"""
+        status = st.empty()
+
+        def waiting():
+            # Any element update lets Streamlit stop this wait when a newer rerun supersedes it
+            status.caption("⏳ Building chart…")
+
+        value = fetch(*args, wait=waiting, **kwargs)
+        status.empty()
+        return value
+
+
+    def show_records(path, key):
+        """Show one page of the customer's rows from ``path``; only that page is selected and formatted"""
+        df, rows, total_events = shared(records, path, selected_customer)
+        pages = max(1, -(-len(rows) // RECORDS_PAGE_SIZE))
+        page = st.number_input(f"Page (of {pages:,})", 1, pages, 1, key=key) if pages > 1 else 1
+        first = (page - 1) * RECORDS_PAGE_SIZE
+        st.caption(f"Rows {first + 1:,}–{min(first + RECORDS_PAGE_SIZE, len(rows)):,} of {len(rows):,}, heaviest first")
+        st.dataframe(
+            records_page(df, rows, total_events, page - 1, RECORDS_PAGE_SIZE),
+            use_container_width=True, hide_index=True
+        )
 
 
     # ---------------------- Create Charts Side by Side ----------------------
@@ -869,54 +601,37 @@ def render_upstream_chart_page():
     # 👉 Show UPSTREAM chart on the LEFT
     with col1:
         if upstream_available:
-            labels_up, parents_up, values_up, ids_up, totals_up, leaf_values_up, has_chain_up = build_upstream_chart(
-                upstream_df, selected_customer, hop_filter
-            )
+            with timer.span("tree_build", direction="upstream"):
+                labels_up, parents_up, values_up, ids_up, totals_up, leaf_values_up = shared(
+                    chart, upstream_csv_path, "upstream", selected_customer, hop_filter, timer=timer
+                )
+            has_chain_up = any(parent_id not in (None, 0) for parent_id in parents_up)
 
             title_suffix = f" – {hop_filter}" if hop_filter != "All Hops" else ""
-
-            fig_upstream = px.icicle(
-                names=labels_up,
-                parents=parents_up,
-                values=values_up,
-                ids=ids_up,
-                title=f"📈 Upstream Partners – {display_name} – {duration}{title_suffix}",
-                color_discrete_sequence=[UPSTREAM_COLOR]
-
-            )
-
-            fig_upstream.update_traces(
-                hovertemplate=(
-                    "<b>%{label}</b><br>" +
-                    "Event Count: %{customdata}<br>" +
-        
-                    "Percent of Total: %{percentRoot:.2%}<br>" +
-                    "<extra></extra>"
-                ),
-                customdata=[totals_up.get(node_id, 0) for node_id in ids_up],
-                marker=dict(colorscale=None, showscale=False)
-            )
-
-            fig_upstream.update_layout(
-                height=600,
-                font_size=10,
-                title_font_size=16,
-                title_font_color="#2c3e50",
-                margin=dict(t=50, l=20, r=20, b=20),
-                paper_bgcolor="#ffffff"
-            )
-            
-
-            st.plotly_chart(
-                fig_upstream,
-                use_container_width=True,
-                config={
-                    "scrollZoom": True,
-                    "displayModeBar": True,
-                    "displaylogo": False,
-                    "modeBarButtonsToAdd": ["pan2d", "zoomIn2d", "zoomOut2d", "autoScale2d", "resetScale2d"]
-                }
-            )
+            with timer.span("tree_fold", direction="upstream", nodes=len(ids_up)):
+                *view_up, drill_up = compact_tree(
+                    labels_up, parents_up, values_up, ids_up, totals_up, key="drill_upstream"
+                )
+
+            with timer.span("figure_build", direction="upstream", nodes=len(view_up[3])):
+                title_up = f"📈 Upstream Partners – {display_name} – {duration}{title_suffix}"
+                fig_upstream = shared(
+                    figure,
+                    (chart_key(upstream_csv_path, "upstream", selected_customer, hop_filter), drill_up, title_up),
+                    lambda: partner_figure(*view_up, title=title_up, color=UPSTREAM_COLOR)
+                )
+
+            with timer.span("chart_render", direction="upstream"):
+                st.plotly_chart(
+                    fig_upstream,
+                    use_container_width=True,
+                    config={
+                        "scrollZoom": True,
+                        "displayModeBar": True,
+                        "displaylogo": False,
+                        "modeBarButtonsToAdd": ["pan2d", "zoomIn2d", "zoomOut2d", "autoScale2d", "resetScale2d"]
+                    }
+                )
 
 
         else:
@@ -927,61 +642,40 @@ def render_upstream_chart_page():
     with col2:
         if downstream_available:
 
-            labels_down, parents_down, values_down, ids_down, totals_down = build_downstream_chart(downstream_df, selected_customer)
-
-            filtered_df_for_total = get_debug_data(downstream_df, "downstream", selected_customer, customer_id)
-            total_downstream_events = filtered_df_for_total['event_count'].sum()
-
-            custom_percentages = []
-            for node_id in ids_down:
-                node_total = totals_down.get(node_id, 0)
-                pct = (node_total / total_downstream_events * 100) if total_downstream_events > 0 else 0
-                custom_percentages.append(pct)
-
-            customdata = [
-                [totals_down.get(node_id, 0), custom_percentages[i]]
-                for i, node_id in enumerate(ids_down)
-            ]
-
-            fig_downstream = px.icicle(
-                names=labels_down,
-                parents=parents_down,
-                values=values_down,
-                ids=ids_down,
-                title=f"📊 Downstream Partners – {display_name} – {duration}",
-                color_discrete_sequence=[DOWNSTREAM_COLOR]
-
-            )
-
-            fig_downstream.update_traces(
-                hovertemplate=(
-                    "<b>%{label}</b><br>" +
-                    "Event Count: %{customdata[0]:,}<br>" +
-                    "Percent of Total: %{customdata[1]:.2f}%<br>" +
-                    "<extra></extra>"
-                ),
-                customdata=customdata,
-                marker=dict(colorscale=None, showscale=False)
-            )
-            fig_downstream.update_layout(
-                height=600,
-                font_size=10,
-                title_font_size=16,
-                title_font_color="#2c3e50",
-                margin=dict(t=50, l=20, r=20, b=20),
-                paper_bgcolor="#ffffff"
-            )
-
-            st.plotly_chart(
-                fig_downstream,
-                use_container_width=True,
-                config={
-                    "scrollZoom": True,
-                    "displayModeBar": True,
-                    "displaylogo": False,
-                    "modeBarButtonsToAdd": ["pan2d", "zoomIn2d", "zoomOut2d", "autoScale2d", "resetScale2d"]
-                }
-            )
+            with timer.span("tree_build", direction="downstream"):
+                labels_down, parents_down, values_down, ids_down, totals_down, _ = shared(
+                    chart, downstream_csv_path, "downstream", selected_customer, hop_labels=False, timer=timer
+                )
+
+            total_downstream_events = downstream_filtered['event_count'].sum()
+
+            with timer.span("tree_fold", direction="downstream", nodes=len(ids_down)):
+                *view_down, drill_down = compact_tree(
+                    labels_down, parents_down, values_down, ids_down, totals_down, key="drill_downstream"
+                )
+
+            with timer.span("figure_build", direction="downstream", nodes=len(view_down[3])):
+                title_down = f"📊 Downstream Partners – {display_name} – {duration}"
+                fig_downstream = shared(
+                    figure,
+                    (chart_key(downstream_csv_path, "downstream", selected_customer, hop_labels=False),
+                     drill_down, title_down),
+                    lambda: partner_figure(
+                        *view_down, title=title_down, color=DOWNSTREAM_COLOR, total_events=total_downstream_events
+                    )
+                )
+
+            with timer.span("chart_render", direction="downstream"):
+                st.plotly_chart(
+                    fig_downstream,
+                    use_container_width=True,
+                    config={
+                        "scrollZoom": True,
+                        "displayModeBar": True,
+                        "displaylogo": False,
+                        "modeBarButtonsToAdd": ["pan2d", "zoomIn2d", "zoomOut2d", "autoScale2d", "resetScale2d"]
+                    }
+                )
 
 
         else:
@@ -991,57 +685,78 @@ def render_upstream_chart_page():
 
 
 
-    # ---------------------- COMBINED EVENT VALIDATION ----------------------
-
-    # ✅ Move function OUTSIDE the checkbox block to avoid scoping issues
-    def validate_tree_data(df, chart_type, selected_customer, customer_id, is_available):
-        if not is_available:
-            return 0, 0, 0
-
-        filtered_df = df.copy()
-        filtered_df.columns = [clean_key(c) for c in filtered_df.columns]
-        filtered_df.fillna('', inplace=True)
-        filtered_df['customer_cleaned'] = filtered_df['customer'].astype(str).apply(deep_clean)
-
-        if selected_customer != "All Customers":
-            if chart_type == "upstream":
-                filtered_df = filtered_df[filtered_df['customer_cleaned'] == selected_customer]
-            else:
-                filtered_df['original_customer_cleaned'] = filtered_df['original_customer'].astype(str).apply(deep_clean)
-                filtered_df = filtered_df[filtered_df['original_customer_cleaned'] == selected_customer]
-
-        if 'event_id' in filtered_df.columns:
-            filtered_df = filtered_df.drop_duplicates(subset=['event_id'])
-        else:
-            filtered_df = filtered_df.drop_duplicates()
-
-        raw_total = filtered_df['event_count'].sum()
-
-        from collections import defaultdict
-        data = filtered_df.to_dict(orient='records')
-        aggregated = defaultdict(int)
-        root_id = "Customer Chain"
-
-        for record in data:
-            event_count = safe_int(record.get('event_count', 0))
-            if event_count == 0:
-                continue
-
-            if chart_type == "upstream":
-                chain = [clean_val(record.get('customer', ''))]
-            else:
-                chain = [clean_val(record.get('original_customer', ''))]
-
-            for i in range(1, 7):
-                cust = clean_val(record.get(f'customer_{i}', ''))
-                if cust:
-                    chain.append(cust)
+    # ---------------------- Monthly Trend ----------------------
+    trend_directions = [
+        direction for direction, available in (("upstream", upstream_available), ("downstream", downstream_available))
+        if available and available_months(kind_of(direction, selected_customer))
+    ]
+    if trend_directions and st.checkbox("📅 Show monthly partner trend"):
+        for column, direction in zip(st.columns(2), trend_directions):
+            with column, timer.span("trend", direction=direction):
+                table = trend(direction, selected_customer)
+                if table.empty:
+                    st.info(f"No monthly {direction} data for this customer.")
+                    continue
+                st.plotly_chart(
+                    trend_figure(table, f"{direction.title()} partners by month – {display_name}"),
+                    use_container_width=True,
+                    config={"displaylogo": False}
+                )
+
+    # ---------------------- Window Comparison ----------------------
+    if (upstream_available or downstream_available) and st.checkbox("🔀 Compare with another duration"):
+        baselines = [option for option in DURATIONS if option != period] + ([CUSTOM_RANGE] if range_months else [])
+        baseline = st.selectbox("Compare against", baselines, key="baseline_duration")
+        baseline_period = baseline
+        if baseline == CUSTOM_RANGE:
+            baseline_period = st.select_slider(
+                "Baseline months", range_months, value=(range_months[0], range_months[0]), key="baseline_months"
+            )
+        baseline_label = period_label(baseline_period)
+        st.caption(f"Events per month in {duration} against {baseline_label}; green partners grew, red ones shrank.")
+
+        comparisons = [
+            ("upstream", upstream_csv_path, {"hop_filter": hop_filter}),
+            ("downstream", downstream_csv_path, {"hop_labels": False}),
+        ]
+        comparisons = [
+            comparison for comparison, available in zip(comparisons, (upstream_available, downstream_available))
+            if available
+        ]
+        for column, (direction, current_path, options) in zip(st.columns(2), comparisons):
+            with column, timer.span("compare", direction=direction):
+                try:
+                    baseline_path = period_csv_path(direction, baseline_period, selected_customer)
+                    current_key = chart_key(current_path, direction, selected_customer, **options)
+                    baseline_key = chart_key(baseline_path, direction, selected_customer, **options)
+                except FileNotFoundError:
+                    st.info(f"No {direction} data for {baseline_label}.")
+                    continue
 
-            aggregated[tuple(chain)] += event_count
+                # Both trees normally come straight from the chart cache; only the merge is new work
+                current = shared(chart, current_path, direction, selected_customer, timer=timer, **options)
+                previous = shared(chart, baseline_path, direction, selected_customer, timer=timer, **options)
+                delta = tree_delta(current, previous, period_months(period), period_months(baseline_period))
+
+                title_delta = f"🔀 {direction.title()} – {display_name} – {duration} vs {baseline_label}"
+                fig_delta = shared(
+                    figure,
+                    (current_key, baseline_key, "delta", title_delta),
+                    lambda: delta_figure(
+                        *fold_delta(delta, MAX_CHILDREN, MAX_NODES_PER_LEVEL), title=title_delta
+                    )
+                )
+                st.plotly_chart(fig_delta, use_container_width=True, config={"displaylogo": False})
+
+                changes = top_changes(delta)
+                if changes:
+                    st.dataframe(
+                        pd.DataFrame(changes).round({"now": 1, "before": 1, "change": 1}),
+                        use_container_width=True, hide_index=True
+                    )
 
-        tree_total = sum(aggregated.values())
-        return raw_total, tree_total, raw_total - tree_total
 
+    # ---------------------- COMBINED EVENT VALIDATION ----------------------
 
     # ✅ Now this part stays inside the checkbox block
     if debug_mode and selected_customer != "All Customers":
@@ -1051,39 +766,34 @@ def render_upstream_chart_page():
         st.write("---")
         st.write("## ✅ Event Count Validation")
 
-        # Run validations
-        downstream_raw, downstream_tree, downstream_diff = validate_tree_data(
-            downstream_df, "downstream", selected_customer, customer_id, downstream_available
-        )
-        upstream_raw, upstream_tree, upstream_diff = validate_tree_data(
-            upstream_df, "upstream", selected_customer, customer_id, upstream_available
-        )
-
-        # Build results table
-        validation_data = []
-
-        if downstream_available:
-            validation_data.append({
-                "Chart Type": "📈 Downstream",
-                "Raw CSV Total": f"{downstream_raw:,}",
-                "Tree Total": f"{downstream_tree:,}",
-                "Difference": f"{downstream_diff:,}",
-                "Status": "✅ Valid" if downstream_diff == 0 else "❌ Invalid"
-            })
+        # Checked by cron_icicle.py when the files were published; nothing is recomputed here
+        verdicts = [
+            (label, verdict(path, selected_customer))
+            for label, path, available in (
+                ("📈 Downstream", downstream_csv_path, downstream_available),
+                ("📊 Upstream", upstream_csv_path, upstream_available),
+            )
+            if available
+        ]
 
-        if upstream_available:
-            validation_data.append({
-                "Chart Type": "📊 Upstream",
-                "Raw CSV Total": f"{upstream_raw:,}",
-                "Tree Total": f"{upstream_tree:,}",
-                "Difference": f"{upstream_diff:,}",
-                "Status": "✅ Valid" if upstream_diff == 0 else "❌ Invalid"
-            })
-
-        if not downstream_available and not upstream_available:
+        if not verdicts:
             st.warning("⚠️ No charts available for validation with the selected customer.")
+        elif any(result is None for _, result in verdicts):
+            st.info("ℹ️ These files have not been validated yet; `cron_icicle.py` checks each snapshot after publishing it.")
         else:
-            validation_df = pd.DataFrame(validation_data)
+            validation_df = pd.DataFrame([
+                {
+                    "Chart Type": label,
+                    "Raw CSV Total": f"{result['raw']:,}",
+                    "Tree Total": f"{result['tree']:,}",
+                    "Difference": f"{result['raw'] - result['tree']:,}",
+                    "Duplicates": f"{result['duplicates']:,}",
+                    "Gaps": f"{result['gaps']:,}",
+                    "Self-forwards": f"{result['self_forwards']:,}",
+                    "Status": "✅ Valid" if result["passed"] else "❌ Invalid"
+                }
+                for label, result in verdicts
+            ])
             st.dataframe(
                 validation_df,
                 use_container_width=True,
@@ -1093,24 +803,31 @@ def render_upstream_chart_page():
                     "Raw CSV Total": st.column_config.TextColumn("📁 Raw Total", width="medium"),
                     "Tree Total": st.column_config.TextColumn("🌳 Tree Total", width="medium"),
                     "Difference": st.column_config.TextColumn("🔍 Difference", width="medium"),
+                    "Duplicates": st.column_config.TextColumn("♊ Duplicate Rows", width="small"),
+                    "Gaps": st.column_config.TextColumn("🕳️ Chain Gaps", width="small"),
+                    "Self-forwards": st.column_config.TextColumn("🔁 Self-forwards", width="small"),
                     "Status": st.column_config.TextColumn("✅ Status", width="small")
                 }
             )
+            st.caption(f"Checked at {min(result['checked_at'] for _, result in verdicts)} by `cron_icicle.py`.")
 
             # Overall summary
-            available_diffs = []
-            if downstream_available:
-                available_diffs.append(downstream_diff)
-            if upstream_available:
-                available_diffs.append(upstream_diff)
-
-            total_issues = sum(1 for diff in available_diffs if diff != 0)
+            total_issues = sum(1 for _, result in verdicts if not result["passed"])
 
             if total_issues == 0:
                 st.success("🎉 **ALL VALIDATIONS PASSED**: Available charts perfectly match their data sources!")
             else:
                 st.error(f"⚠️ **{total_issues} VALIDATION ISSUE(S)**: Some charts have data mismatches.")
 
+            mismatches = {
+                label: result["mismatch_examples"] for label, result in verdicts if result["id_name_mismatches"]
+            }
+            if mismatches:
+                with st.expander("🪪 Customer ids used with more than one name (whole file)"):
+                    for label, examples in mismatches.items():
+                        st.markdown(f"**{label}**")
+                        st.json(examples)
+
 
 
 
@@ -1124,39 +841,6 @@ def render_upstream_chart_page():
 
 
         
-        # Position analysis for available charts only
-        def analyze_positions(df, chart_type, selected_customer):
-            positions = {}
-            events = {}
-            
-            for _, row in df.iterrows():
-                event_count = safe_int(row.get('event_count', 0))
-                
-                if chart_type == "downstream":
-                    if deep_clean(row.get('original_customer', '')) == selected_customer:
-                        pos = 'Root'
-                        positions[pos] = positions.get(pos, 0) + 1
-                        events[pos] = events.get(pos, 0) + event_count
-                    
-                    for i in range(1, 7):
-                        if deep_clean(row.get(f'customer_{i}', '')) == selected_customer:
-                            pos = f'Pos-{i}'
-                            positions[pos] = positions.get(pos, 0) + 1
-                            events[pos] = events.get(pos, 0) + event_count
-                else:  # upstream
-                    if deep_clean(row.get('customer', '')) == selected_customer:
-                        pos = 'Base'
-                        positions[pos] = positions.get(pos, 0) + 1
-                        events[pos] = events.get(pos, 0) + event_count
-                    
-                    for i in range(1, 7):
-                        if deep_clean(row.get(f'customer_{i}', '')) == selected_customer:
-                            pos = f'Up-{i}'
-                            positions[pos] = positions.get(pos, 0) + 1
-                            events[pos] = events.get(pos, 0) + event_count
-            
-            return positions, events
-        
         # Create columns based on availability
         if downstream_available and upstream_available:
             col1, col2 = st.columns(2)
@@ -1168,7 +852,8 @@ def render_upstream_chart_page():
         if downstream_available:
             with col1 if col2 else col1:
                 st.write("#### 📈 Downstream Positions")
-                down_pos, down_events = analyze_positions(downstream_filtered, "downstream", selected_customer)
+                with timer.span("debug", step="analyze_positions", direction="downstream"):
+                    down_pos, down_events = shared(positions, downstream_csv_path, "downstream", selected_customer)
                 if down_pos:
                     for pos, count in down_pos.items():
                         st.write(f"**{pos}**: {count:,} records, {down_events[pos]:,} events")
@@ -1179,7 +864,8 @@ def render_upstream_chart_page():
         if upstream_available:
             with col2 if col2 else col1:
                 st.write("#### 📊 Upstream Positions")
-                up_pos, up_events = analyze_positions(upstream_filtered, "upstream", selected_customer)
+                with timer.span("debug", step="analyze_positions", direction="upstream"):
+                    up_pos, up_events = shared(positions, upstream_csv_path, "upstream", selected_customer)
                 if up_pos:
                     for pos, count in up_pos.items():
                         st.write(f"**{pos}**: {count:,} records, {up_events[pos]:,} events")
@@ -1195,37 +881,15 @@ def render_upstream_chart_page():
         else:
             if downstream_available and not downstream_filtered.empty:
                 st.write("### 📈 Downstream Records")
-                downstream_display = downstream_filtered[
-                    [col for col in downstream_filtered.columns
-                    if col in ['event_count']
-                    or (col.startswith('customer_') and not col.endswith('_id')
-                        and col != 'customer' and col != 'customer_cleaned')]
-                ]
-                downstream_display = downstream_display.sort_values(by="event_count", ascending=False)
-                total_event_count = downstream_display["event_count"].sum()
-                downstream_display["percentage"] = (
-                    downstream_display["event_count"] / total_event_count * 100
-                ).round(2).astype(str) + '%'
-                st.dataframe(downstream_display, use_container_width=True, hide_index=True)
+                show_records(downstream_csv_path, key="records_page_downstream")
 
     # ✅ Upstream CSV display (silently skip for All Customers)
     if selected_customer != "All Customers":
-        if not has_chain_up:
+        if upstream_available and not has_chain_up:
             st.info("ℹ️ No upstream chain beyond the customer — skipping raw upstream CSV records.")
         elif upstream_available and not upstream_filtered.empty:
             st.write("### 📊 Upstream Records")
-            upstream_display = upstream_filtered[
-                [col for col in upstream_filtered.columns
-                if col in ['event_count']
-                or (col.startswith('customer_') and not col.endswith('_id')
-                    and col != 'customer' and col != 'customer_cleaned')]
-            ]
-            upstream_display = upstream_display.sort_values(by="event_count", ascending=False)
-            total_event_count = upstream_display["event_count"].sum()
-            upstream_display["percentage"] = (
-                upstream_display["event_count"] / total_event_count * 100
-            ).round(2).astype(str) + '%'
-            st.dataframe(upstream_display, use_container_width=True, hide_index=True)
+            show_records(upstream_csv_path, key="records_page_upstream")
 
 
 
@@ -1325,122 +989,48 @@ def render_upstream_chart_page():
 
 
     # -- ---------------------- BEST PATHS ONLY ----------------------
-    if selected_customer != "All Customers":
+    def render_top_paths(aggregated, direction, top_n):
+        st.write(f"#### 🏆 Top {top_n} {direction} Paths")
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    "Rank": row["rank"],
+                    "Path": format_path(row["path"]),
+                    "Hops": row["hops"],
+                    "Events": row["events"],
+                    "Share": f"{row['share']:.2f}%",
+                }
+                for row in top_paths(aggregated, top_n)
+            ]),
+            use_container_width=True,
+            hide_index=True
+        )
+        with st.expander(f"📶 {direction} paths by hop depth"):
+            for hops, ranked in top_paths_by_depth(aggregated, top_n).items():
+                st.write(f"**Hop {hops}**")
+                for row in ranked:
+                    st.write(f"**{row['rank']}.** {format_path(row['path'])} – *{row['events']:,} events* ({row['share']:.2f}%)")
 
+    if selected_customer != "All Customers":
+        top_n = st.number_input("Top N paths", min_value=1, max_value=100, value=10, step=1)
 
         if downstream_available and not downstream_filtered.empty:
-            downstream_data = downstream_filtered.to_dict(orient='records')
-            downstream_leaf_values = {}
-            root_id = "Customer Chain"
-
-            for record in downstream_data:
-                customer = clean_val(record.get('original_customer', ''))
-                event_count = safe_int(record.get('event_count', 0))
-                if not customer or event_count == 0:
-                    continue
-
-                chain = [customer]
-                for i in range(1, 7):
-                    cust = clean_val(record.get(f'customer_{i}', ''))
-                    if cust:
-                        chain.append(cust)
-                    else:
-                        break
-
-                path_ids = [root_id] + chain
-                leaf_id = "/".join(path_ids)
-                downstream_leaf_values[leaf_id] = downstream_leaf_values.get(leaf_id, 0) + event_count
-
-            if downstream_leaf_values:
-                st.write("#### 🏆 Top 10 Downstream Paths")
-                sorted_downstream = sorted(downstream_leaf_values.items(), key=lambda x: x[1], reverse=True)[:10]
-                for i, (path, count) in enumerate(sorted_downstream, 1):
-                    display_path = path.replace("Customer Chain/", "")
-                    if len(display_path) > 60:
-                        display_path = display_path[:57] + "..."
-                    st.write(f"**{i}.** {display_path} – *{count:,} events*")
+            with timer.span("top_paths", direction="downstream"):
+                downstream_paths = aggregate_paths(chain_records(downstream_filtered))
+            if downstream_paths:
+                render_top_paths(downstream_paths, "Downstream", top_n)
 
         if upstream_available and not upstream_filtered.empty:
-            upstream_data = upstream_filtered.to_dict(orient='records')
-            upstream_leaf_values = {}
-            root_id = "Customer Chain"
-
-            for record in upstream_data:
-                event_count = safe_int(record.get('event_count', 0))
-                if event_count == 0:
-                    continue
+            with timer.span("top_paths", direction="upstream"):
+                upstream_paths = aggregate_paths(chain_records(upstream_filtered))
+            if upstream_paths:
+                render_top_paths(upstream_paths, "Upstream", top_n)
 
-                base_customer = clean_val(record.get('customer', ''))
-                chain = [base_customer]
-                for i in range(1, 7):
-                    cust = clean_val(record.get(f'customer_{i}', ''))
-                    if cust:
-                        chain.append(cust)
 
-                path_ids = [root_id] + chain
-                leaf_id = "/".join(path_ids)
-                upstream_leaf_values[leaf_id] = upstream_leaf_values.get(leaf_id, 0) + event_count
 
-            if upstream_leaf_values:
-                st.write("#### 🏆 Top 10 Upstream Paths")
-                sorted_upstream = sorted(upstream_leaf_values.items(), key=lambda x: x[1], reverse=True)[:10]
-                for i, (path, count) in enumerate(sorted_upstream, 1):
-                    display_path = path.replace("Customer Chain/", "")
-                    if len(display_path) > 60:
-                        display_path = display_path[:57] + "..."
-                    st.write(f"**{i}.** {display_path} – *{count:,} events*")
-
-
-
-    # ---------------------- DEBUG: Validate Upstream Totals ----------------------
-    if debug_mode and selected_customer != "All Customers":
-        st.write("## 🛠 Debug: Validate Upstream Totals")
-
-        try:
-            # ✅ FIXED: Use the SAME file that the chart is using
-            debug_upstream_csv_path = upstream_csv_path  # This matches your chart's data source
-            csv_upstream = pd.read_csv(debug_upstream_csv_path)
-            
-            
-            # ✅ FIXED: Use the SAME filtering logic as your chart
-            csv_upstream.columns = [clean_key(col) for col in csv_upstream.columns]
-            csv_upstream.fillna('', inplace=True)
-            csv_upstream['customer_cleaned'] = csv_upstream['customer'].astype(str).apply(deep_clean)
-            
-            # ✅ Match chart logic: only rows relevant to selected customer
-            upstream_filtered_debug = get_debug_data(csv_upstream, "upstream", selected_customer, customer_id)
-
-
-            
-            # ✅ Match CLI dedup logic exactly
-            # ❌ Don't deduplicate – match CLI logic (raw total only)
-            st.info("ℹ️ No deduplication applied – using raw event count like CLI")
-            raw_upstream_total = upstream_filtered_debug['event_count'].sum()
-
-
-            # ✅ Get chart total (this should be correct already)
-            try:
-                chart_total = sum(leaf_values_up.get(node_id, 0) for node_id in ids_up if node_id in leaf_values_up)
-
-
-            except:
-                chart_total = 0
-
-            st.markdown(f"- **Raw CSV total from upstream file:** `{raw_upstream_total:,}`")
-            st.markdown(f"- **Chart total based on tree structure:** `{chart_total:,}`")
-            st.markdown(f"- **File used:** `{debug_upstream_csv_path}`")
-            st.markdown(f"- **Records found:** `{len(upstream_filtered_debug):,}`")
-
-            # ✅ Show difference and mismatched records
-            if raw_upstream_total != chart_total:
-                st.warning(f"⚠️ Mismatch: Difference = {raw_upstream_total - chart_total:,}")
-                with st.expander("🔍 See upstream records from CSV"):
-                    display_cols = ['customer', 'customer_1', 'customer_2', 'customer_3', 'customer_4', 'customer_5', 'customer_6', 'event_count']
-                    display_cols = [col for col in display_cols if col in upstream_filtered_debug.columns]
-                    st.dataframe(upstream_filtered_debug[display_cols].head(10))
-            else:
-                st.success("✅ The chart total matches the CSV total perfectly.")
-
-        except Exception as e:
-            st.error(f"🔴 Error validating upstream totals: {e}")
-            st.error(f"Expected file path: {upstream_csv_path}")
\ No newline at end of file
+    # ---------------------- Performance Overlay ----------------------
+    perf = timer.emit()
+    if debug_mode:
+        with st.expander(f"⏱️ Performance – {perf['total_ms']:,.0f} ms this rerun"):
+            st.caption(f"Customer: {selected_customer} · Duration: {duration} · phases slower than {timer.slow_ms:,.0f} ms are flagged")
+            st.dataframe(pd.DataFrame(timer.rows()), use_container_width=True, hide_index=True)
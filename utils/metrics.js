@@ -0,0 +1,87 @@
+// Minimal Prometheus text-format metrics for the token service.
+// GET /metrics renders everything registered here.
+
+const metrics = [];
+
+const DEFAULT_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5];
+
+const labelKey = (labels) => JSON.stringify(Object.entries(labels).sort());
+
+const formatLabels = (labels) => {
+  const entries = Object.entries(labels);
+  if (!entries.length) return '';
+  const parts = entries.map(([k, v]) => `${k}="${String(v).replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n')}"`);
+  return `{${parts.join(',')}}`;
+};
+
+function counter(name, help) {
+  const values = new Map();
+  const metric = {
+    inc(labels = {}, amount = 1) {
+      const key = labelKey(labels);
+      const current = values.get(key) || { labels, value: 0 };
+      current.value += amount;
+      values.set(key, current);
+    },
+    render() {
+      const lines = [`# HELP ${name} ${help}`, `# TYPE ${name} counter`];
+      for (const { labels, value } of values.values())
+        lines.push(`${name}${formatLabels(labels)} ${value}`);
+      return lines.join('\n');
+    },
+  };
+  metrics.push(metric);
+  return metric;
+}
+
+// Gauges are read when scraped, so they never go stale
+function gauge(name, help, collect) {
+  const metric = {
+    render() {
+      return [`# HELP ${name} ${help}`, `# TYPE ${name} gauge`, `${name} ${collect()}`].join('\n');
+    },
+  };
+  metrics.push(metric);
+  return metric;
+}
+
+function histogram(name, help, buckets = DEFAULT_BUCKETS) {
+  const series = new Map();
+  const metric = {
+    observe(labels, seconds) {
+      const key = labelKey(labels);
+      let current = series.get(key);
+      if (!current) {
+        current = { labels, counts: buckets.map(() => 0), sum: 0, count: 0 };
+        series.set(key, current);
+      }
+      buckets.forEach((bound, i) => {
+        if (seconds <= bound) current.counts[i]++;
+      });
+      current.sum += seconds;
+      current.count++;
+    },
+    // Returns a function that records the seconds elapsed since startTimer was called
+    startTimer(labels = {}) {
+      const start = process.hrtime.bigint();
+      return (extra = {}) => metric.observe({ ...labels, ...extra }, Number(process.hrtime.bigint() - start) / 1e9);
+    },
+    render() {
+      const lines = [`# HELP ${name} ${help}`, `# TYPE ${name} histogram`];
+      for (const { labels, counts, sum, count } of series.values()) {
+        buckets.forEach((bound, i) =>
+          lines.push(`${name}_bucket${formatLabels({ ...labels, le: bound })} ${counts[i]}`));
+        lines.push(`${name}_bucket${formatLabels({ ...labels, le: '+Inf' })} ${count}`);
+        lines.push(`${name}_sum${formatLabels(labels)} ${sum}`);
+        lines.push(`${name}_count${formatLabels(labels)} ${count}`);
+      }
+      return lines.join('\n');
+    },
+  };
+  metrics.push(metric);
+  return metric;
+}
+
+const render = () => metrics.map((metric) => metric.render()).join('\n') + '\n';
+
+module.exports = { counter, gauge, histogram, render };
@@ -0,0 +1,22 @@
+const metrics = require('./metrics');
+const tokenStore = require('./tokenStore');
+
+module.exports = {
+  requests: metrics.counter(
+    'token_requests_total',
+    'Token API requests by operation and result.'
+  ),
+  duration: metrics.histogram(
+    'token_operation_duration_seconds',
+    'Time spent handling token API requests.'
+  ),
+  expirations: metrics.counter(
+    'token_expirations_total',
+    'Expired tokens removed from the store, by where they were found.'
+  ),
+  storeSize: metrics.gauge(
+    'token_store_size',
+    'Tokens currently held in memory.',
+    () => tokenStore.size
+  ),
+};